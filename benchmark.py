@@ -0,0 +1,298 @@
+import argparse
+import importlib.metadata
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+import catan
+from catan import RandomAgent
+
+
+def rate(function, min_time):
+    """
+    Calls a function repeatedly for at least min_time seconds.
+
+    :param function: The function to time, called without arguments.
+    :param min_time: The least number of seconds to spend calling it.
+    :return: The number of calls per second.
+    """
+    calls = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_time:
+        function()
+        calls += 1
+    return calls / elapsed
+
+
+def latency(times):
+    """
+    :param times: How many seconds each of many calls took.
+    :return: The mean, median and 99th percentile in microseconds.
+    """
+    times = np.asarray(times) * 1e6
+    return {"mean_us": float(times.mean()), "median_us": float(np.median(times)),
+            "p99_us": float(np.percentile(times, 99))}
+
+
+def new_game(seed):
+    """
+    :param seed: The seed of the game.
+    :return: A board that has been set up for uniform agents and is ready for its first turn.
+    """
+    board = catan.Board(seed)
+    board.setup(RandomAgent())
+    return board
+
+
+def bench_board(min_time, seed):
+    """
+    Times constructing boards, including generating their layouts, and generating layouts in bulk.
+    """
+    seeds = itertools.count(seed)
+    rng = np.random.default_rng(seed)
+    bulk = 10000
+    return {"boards_per_second": rate(lambda: catan.Board(next(seeds)), min_time / 2),
+            "bulk_layouts_per_second": bulk * rate(lambda: catan.random_layouts(bulk, rng), min_time / 2)}
+
+
+def bench_steps(min_time, seed):
+    """
+    Times Player.roll and Player.move separately across whole games, starting a new game whenever one ends.
+    """
+    distribution = RandomAgent().get_action(None)
+    roll = move = 0.0
+    rolls = moves = 0
+    board = new_game(seed)
+    while roll + move < min_time:
+        if board.is_game_over:
+            seed += 1
+            board = new_game(seed)
+        player = board.players[board.current]
+        start = time.perf_counter()
+        player.roll()
+        middle = time.perf_counter()
+        player.move(distribution)
+        end = time.perf_counter()
+        board.end_turn()
+        roll += middle - start
+        move += end - middle
+        rolls += 1
+        moves += 1
+    return {"rolls_per_second": rolls / roll, "moves_per_second": moves / move}
+
+
+def bench_get_state(min_time, seed):
+    """
+    Times Player.get_state at every decision of whole games.
+    """
+    distribution = RandomAgent().get_action(None)
+    times = []
+    spent = 0.0
+    board = new_game(seed)
+    while spent < min_time:
+        if board.is_game_over:
+            seed += 1
+            board = new_game(seed)
+        board.begin_turn()
+        player = board.players[board.current]
+        start = time.perf_counter()
+        player.get_state()
+        times.append(time.perf_counter() - start)
+        spent += times[-1]
+        board.act(distribution)
+    return latency(times)
+
+
+def grow_road(board, player, n_roads):
+    """
+    Builds a road network for one player by repeatedly adding a random legal road.
+
+    :param board: A board whose setup has been played.
+    :param player: The player to build for.
+    :param n_roads: The number of roads the player should own.
+    :return: The paths the player owns, or fewer than n_roads if they ran out of room.
+    """
+    while (board.path_owner == player).sum() < n_roads:
+        paths = np.flatnonzero(board.legal_moves(player)[0])
+        if not len(paths):
+            break
+        board.place_road(player, int(paths[board.rng.randrange(len(paths))]))
+    return np.flatnonzero(board.path_owner == player)
+
+
+def bench_longest_road(min_time, seed, road_counts=(2, 5, 10, 15, 20)):
+    """
+    Times keeping the longest road current at different network sizes: the update a new road triggers, the check
+    a road-building heuristic makes for a candidate road, and the award check at the end of every turn.
+    """
+    results = {}
+    for n_roads in road_counts:
+        board = new_game(seed)
+        paths = grow_road(board, 0, n_roads)
+        network = board.road_network
+        candidates = np.flatnonzero(board.legal_moves(0)[0])
+        candidate = int(candidates[0]) if len(candidates) else int(paths[0])
+        per_call = min_time / 3
+        results[str(len(paths))] = {
+            "road_built_per_second": rate(lambda: network.road_built(0, int(paths[-1])), per_call),
+            "longest_with_per_second": rate(lambda: network.longest_with(0, candidate), per_call),
+            "award_check_per_second": rate(board.longest_road, per_call),
+        }
+    return results
+
+
+def bench_games(min_time, seed):
+    """
+    Times playing whole games without rendering or printing, one at a time and in lockstep batches.
+    """
+    results = {}
+    for name, batch in (("games_per_second", False), ("batched_games_per_second", True)):
+        games = turns = 0
+        start = time.perf_counter()
+        while (elapsed := time.perf_counter() - start) < min_time:
+            trajectories = catan.simulate(8, RandomAgent(), seed + games, batch=batch)
+            games += len(trajectories)
+            turns += sum(trajectory.final_turn for trajectory in trajectories)
+        results[name] = games / elapsed
+    results["turns_per_game"] = turns / games
+    return results
+
+
+def bench_train(min_time, seed, batch_sizes=(None, 256)):
+    """
+    Times ReinforcementAgent.train on self-play samples, in one step and in minibatches.
+    """
+    import reinforcement  # pulls in torch, which the other benchmarks don't need
+
+    trajectories = catan.simulate(16, RandomAgent(), seed, batch=True)
+    states, actions, rewards = (np.concatenate(arrays) for arrays in
+                                zip(*[(trajectory.states, trajectory.actions, trajectory.rewards)
+                                      for trajectory in trajectories]))
+    agent = reinforcement.ReinforcementAgent()
+    results = {"device": agent.device, "samples": len(states)}
+    for batch_size in batch_sizes:
+        calls = rate(lambda: agent.train(states, actions, rewards, 0, batch_size=batch_size), min_time)
+        results[f"samples_per_second_batch_{batch_size or 'all'}"] = calls * len(states)
+    return results
+
+
+def bench_inference(min_time, seed, compilers=(None, "script", "compile")):
+    """
+    Times ReinforcementAgent.get_action on single states, as games call it, with the network run as it is and
+    compiled each way.
+    """
+    import reinforcement  # pulls in torch, which the other benchmarks don't need
+    from runtime import Runtime
+
+    states = catan.simulate(1, RandomAgent(), seed)[0].states
+    results = {}
+    for compiler in compilers:
+        agent = reinforcement.ReinforcementAgent(rollout_runtime=Runtime(compiler=compiler))
+        agent.get_action(states[0])  # compiles
+        times = []
+        spent = 0.0
+        for state in itertools.cycle(states):
+            start = time.perf_counter()
+            agent.get_action(state)
+            times.append(time.perf_counter() - start)
+            spent += times[-1]
+            if spent >= min_time / len(compilers):
+                break
+        results[compiler or "eager"] = latency(times)
+    return results
+
+
+BENCHMARKS = {"board": bench_board, "steps": bench_steps, "get_state": bench_get_state,
+              "longest_road": bench_longest_road, "games": bench_games, "train": bench_train,
+              "inference": bench_inference}
+
+
+def commit():
+    """
+    :return: The git commit the working tree is on, marked dirty if it has changes, or None outside a repository.
+    """
+    try:
+        described = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                                   check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return described.stdout.strip()
+
+
+def run(names=None, min_time=1.0, seed=0):
+    """
+    Runs the benchmarks.
+
+    :param names: The benchmarks to run, all of them by default.
+    :param min_time: The least number of seconds to spend on each measurement.
+    :param seed: The seed of the first game each benchmark plays.
+    :return: The results, along with what they were measured on.
+    """
+    results = {"commit": commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version(),
+               "numpy": np.__version__, "torch": importlib.metadata.version("torch"),  # without importing it
+               "machine": platform.platform(), "processor": platform.processor(), "min_time": min_time,
+               "benchmarks": {}}
+    for name in names or BENCHMARKS:
+        print(f"Running {name}...")
+        results["benchmarks"][name] = BENCHMARKS[name](min_time, seed)
+    return results
+
+
+def flatten(results, prefix=""):
+    """
+    :param results: Nested benchmark results.
+    :param prefix: The name of the level being flattened.
+    :return: The numeric results keyed by their dotted names.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old, new):
+    """
+    Prints how each result changed between two runs. Rates should go up and latencies down.
+
+    :param old: The results of the earlier run.
+    :param new: The results of the later run.
+    """
+    print(f"{old['commit']} -> {new['commit']}")
+    old, new = flatten(old["benchmarks"]), flatten(new["benchmarks"])
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key] / old[key] if old[key] else float("nan")
+        print(f"{key:60} {old[key]:14.2f} {new[key]:14.2f} {ratio:7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how fast the game and the training loop run.")
+    parser.add_argument("benchmarks", nargs="*", help=f"the benchmarks to run, out of {', '.join(BENCHMARKS)}; all of "
+                                                      f"them by default")
+    parser.add_argument("--output", "-o", default="benchmark.json", help="where to write the results as JSON")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds to spend on each measurement")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the games played")
+    parser.add_argument("--compare", metavar="JSON", help="earlier results to compare these against")
+    arguments = parser.parse_args()
+    unknown = set(arguments.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = run(arguments.benchmarks, arguments.min_time, arguments.seed)
+    print(json.dumps(results, indent=2))
+    with open(arguments.output, "w") as file:
+        json.dump(results, file, indent=2)
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            compare(json.load(file), results)
+
+
+if __name__ == '__main__':
+    main()
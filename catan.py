@@ -1,11 +1,39 @@
-from random import random, randint, shuffle, choice
+from collections import namedtuple
+from contextlib import nullcontext
+from copy import copy
+from itertools import combinations
+from collections.abc import MutableMapping
+from random import Random
 
-import matplotlib.pyplot as plt
-from numpy import argmax, mean
-from numpy.random import choice as np_choice
-from sympy import cos, pi, sin
+from numpy import (arange, argmax, argsort, array, asarray, column_stack, concatenate, dtype, flatnonzero, frombuffer,
+                   full, load, put_along_axis, save, sort, stack, zeros)
+from numpy.random import SeedSequence, default_rng
 
 UNOWNED = "lightgray"
+NOBODY = -1  # owner of anything unbuilt in the board's arrays
+NO_HARBOR = -1
+NO_RESOURCE = -1  # an empty side of a trade offer
+
+RESOURCES = ("ore", "brick", "wheat", "lumber", "sheep")
+RESOURCE_INDEX = {resource: r for r, resource in enumerate(RESOURCES)}
+STATE_RESOURCES = ("brick", "lumber", "sheep", "wheat", "ore")  # the order expected production has in states
+TERRAINS = RESOURCES + ("desert", "water")
+HARBORS = RESOURCES + ("3:1",)
+PLAYER_NAMES = ("red", "green", "blue", "yellow")
+INSTRUCTIONS = 6  # build a road, settlement or city, buy or play a dev card, trade
+
+# the land tiles' terrain and dice, and the harbors, of a standard game, as the board's arrays hold them
+LAND_TERRAIN = array([TERRAINS.index(terrain) for terrain in ("ore", "brick") * 3 + ("wheat", "lumber", "sheep") * 4
+                      + ("desert",)], dtype="int8")
+HIGH_DICE = (6, 6, 8, 8)  # never on neighbouring tiles
+LAND_DICE = array(HIGH_DICE + (2, 3, 3, 4, 4, 5, 5, 9, 9, 10, 10, 11, 11, 12) + (7,), dtype="int8")
+HARBOR_KINDS = array([HARBORS.index(harbor) for harbor in RESOURCES + ("3:1",) * 4], dtype="int8")  # never adjacent
+
+# chance of each dice total, indexed by the total; 7 never produces
+DIE_PROBABILITY = array([0, 0, 1, 2, 3, 4, 5, 0, 5, 4, 3, 2, 1]) / 36
+
+SQRT3 = 3 ** 0.5
+HEX_DIRECTIONS = ((1, 0), (0, 1), (-1, 1), (-1, 0), (0, -1), (1, -1))
 
 
 def flatten_counts(counter):
@@ -15,17 +43,63 @@ def flatten_counts(counter):
     return lst
 
 
-class Tile:  # there are 19 tiles on the board
-    def __init__(self, a, b, terrain_type, die):
-        self.a = a
-        self.b = b
-        self.terrain_type = terrain_type
-        self.die = die
-        self.probability = 0 if self.die == 7 else (6 - abs(self.die - 7)) / 36
-        self.neighbors = {}
-        self.spots = {}
-        self.paths = {}
-        self.robber = False
+class Hand(MutableMapping):  # a player's resource cards, as a dict-like view onto their row of board.resources
+    def __init__(self, board, player):
+        self.board = board
+        self.player = player
+
+    def __getitem__(self, resource):
+        return int(self.board.resources[self.player, RESOURCE_INDEX[resource]])
+
+    def __setitem__(self, resource, count):
+        self.board.resources[self.player, RESOURCE_INDEX[resource]] = count
+
+    def __delitem__(self, resource):
+        raise TypeError("resources can't be removed from a hand")
+
+    def __iter__(self):
+        return iter(RESOURCES)
+
+    def __len__(self):
+        return len(RESOURCES)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Tile:  # there are 19 tiles on the board; a read-only view onto the board's arrays
+    def __init__(self, board, id):
+        self.board = board
+        self.id = id
+        self.a, self.b = TOPOLOGY.tile_xy[id]
+
+    @property
+    def terrain_type(self):
+        return TERRAINS[self.board.terrain[self.id]]
+
+    @property
+    def die(self):
+        return int(self.board.dice[self.id])
+
+    @property
+    def probability(self):
+        return self.board.probability[self.id]
+
+    @property
+    def robber(self):
+        return self.board.robber == self.id
+
+    @property
+    def neighbors(self):
+        return {(tile.a, tile.b): tile for tile in (self.board.tile_views[t] for t in TOPOLOGY.tile_neighbors[self.id])}
+
+    @property
+    def spots(self):
+        return {(spot.a, spot.b): spot for spot in (self.board.spot_views[s] for s in TOPOLOGY.tile_spots[self.id])}
+
+    @property
+    def paths(self):
+        return {(path.a, path.b): path for path in (self.board.path_views[p] for p in TOPOLOGY.tile_paths[self.id])}
 
     def __eq__(self, other):
         return self.a == other.a and self.b == other.b
@@ -53,14 +127,32 @@ class Tile:  # there are 19 tiles on the board
         return str(self)
 
 
-class Spot:  # there are 54 spots on the board
-    def __init__(self, *tiles: Tile):
-        self.a = self.b = None
-        self.tiles = tiles
-        self.neighbors = {}
-        self.paths = {}
-        self.build_level = 0
-        self.owner = UNOWNED
+class Spot:  # there are 54 spots on the board; a read-only view onto the board's arrays
+    def __init__(self, board, id):
+        self.board = board
+        self.id = id
+        self.a, self.b = TOPOLOGY.spot_xy[id]
+
+    @property
+    def tiles(self):
+        return tuple(self.board.tile_views[t] for t in TOPOLOGY.spot_tiles[self.id])
+
+    @property
+    def neighbors(self):
+        return {(spot.a, spot.b): spot for spot in (self.board.spot_views[s] for s in TOPOLOGY.spot_neighbors[self.id])}
+
+    @property
+    def paths(self):
+        return {(path.a, path.b): path for path in (self.board.path_views[p] for p in TOPOLOGY.spot_paths[self.id])}
+
+    @property
+    def build_level(self):
+        return int(self.board.spot_level[self.id])
+
+    @property
+    def owner(self):
+        owner = self.board.spot_owner[self.id]
+        return UNOWNED if owner == NOBODY else PLAYER_NAMES[owner]
 
     def __eq__(self, other):
         return self.a == other.a and self.b == other.b
@@ -84,15 +176,35 @@ class Spot:  # there are 54 spots on the board
         return str(self)
 
 
-class Path:  # there are 72 paths on the board
-    def __init__(self, key, harbor):
-        self.a, self.b = key
-        self.spots = None
-        self.neighbors = {}
-        self.harbor = harbor
-        self.build_level = 0
-        self.owner = UNOWNED
-        self.visited = False
+class Path:  # there are 72 paths on the board; a read-only view onto the board's arrays
+    def __init__(self, board, id):
+        self.board = board
+        self.id = id
+        self.a, self.b = TOPOLOGY.path_xy[id]
+
+    @property
+    def spots(self):
+        return tuple(TOPOLOGY.spot_xy[s] for s in TOPOLOGY.path_spots[self.id])
+
+    @property
+    def neighbors(self):
+        return {(path.a, path.b): path for path in (self.board.path_views[p] for p in TOPOLOGY.path_neighbors[self.id])}
+
+    @property
+    def harbor(self):
+        harbor = self.board.harbors[self.id]
+        if harbor != NO_HARBOR:
+            return HARBORS[harbor]
+        return None if self.id in TOPOLOGY.coastal else "N/A"
+
+    @property
+    def build_level(self):
+        return int(self.board.path_owner[self.id] != NOBODY)
+
+    @property
+    def owner(self):
+        owner = self.board.path_owner[self.id]
+        return UNOWNED if owner == NOBODY else PLAYER_NAMES[owner]
 
     def __eq__(self, other):
         return self.a == other.a and self.b == other.b
@@ -110,178 +222,378 @@ class Path:  # there are 72 paths on the board
         return str(self)
 
 
-class Board:
-    def __init__(self):
-        terrain_types = ["ore", "brick"] * 3 + ["wheat", "lumber", "sheep"] * 4
-        dice = [2, 3, 3, 4, 4, 5, 5, 6, 6, 8, 8, 9, 9, 10, 10, 11, 11, 12]
-        shuffle(terrain_types)
-        pairs = list(zip(terrain_types, dice))
-        pairs.append(("desert", 7))
-        shuffle(pairs)
-        terrain_types, dice = zip(*pairs)
-
-        self.tiles = {(0, 0): Tile(0, 0, terrain_types[0], dice[0])}
-        h = 1
-        x = pi / 3
-
-        def rgfdgfds(pair):
-            increment = False
-            if pair not in self.tiles:
-                if pair[0] ** 2 + pair[1] ** 2 <= 4:
-                    self.tiles[pair] = Tile(*pair, terrain_types[h], dice[h])
-                    increment = True
+class Topology:  # the fixed skeleton of the board, shared by every game
+    def __init__(self, radius=2):
+        axial = [(q, r) for r in range(-radius - 1, radius + 2) for q in range(-radius - 1, radius + 2)
+                 if max(abs(q), abs(r), abs(q + r)) <= radius + 1]
+        # land tiles come first so that tile ids 0..18 can index per-game terrain and dice
+        axial.sort(key=lambda qr: max(abs(qr[0]), abs(qr[1]), abs(sum(qr))) > radius)
+        ids = {qr: i for i, qr in enumerate(axial)}
+        self.n_tiles = len(axial)
+        self.n_land = sum(max(abs(q), abs(r), abs(q + r)) <= radius for q, r in axial)
+        self.tile_xy = [(round(q + r / 2, 9), round(r * SQRT3 / 2, 9)) for q, r in axial]
+        self.tile_neighbors = [tuple(ids[(q + dq, r + dr)] for dq, dr in HEX_DIRECTIONS if (q + dq, r + dr) in ids)
+                               for q, r in axial]
+
+        spots = set()
+        for t in range(self.n_land):
+            for t2 in self.tile_neighbors[t]:
+                for t3 in self.tile_neighbors[t2]:
+                    if t3 in self.tile_neighbors[t]:
+                        spots.add(tuple(sorted((t, t2, t3))))
+        self.spot_tiles = sorted(spots)
+        self.spot_xy = [tuple(round(sum(self.tile_xy[t][i] for t in tiles) / 3, 9) for i in range(2))
+                        for tiles in self.spot_tiles]
+
+        self.path_spots = [(s, s2) for s in range(len(self.spot_tiles)) for s2 in range(s + 1, len(self.spot_tiles))
+                           if len(set(self.spot_tiles[s]).union(self.spot_tiles[s2])) == 4]
+        self.path_xy = [tuple(round((self.spot_xy[s][i] + self.spot_xy[s2][i]) / 2, 9) for i in range(2))
+                        for s, s2 in self.path_spots]
+        self.coastal = [p for p, spots in enumerate(self.path_spots)
+                        if all(any(t >= self.n_land for t in self.spot_tiles[s]) for s in spots)]
+
+        self.spot_paths = [tuple(p for p, spots in enumerate(self.path_spots) if s in spots)
+                           for s in range(len(self.spot_tiles))]
+        self.spot_neighbors = [tuple(s2 for p in self.spot_paths[s] for s2 in self.path_spots[p] if s2 != s)
+                               for s in range(len(self.spot_tiles))]
+        self.path_neighbors = [tuple(p2 for s in spots for p2 in self.spot_paths[s] if p2 != p)
+                               for p, spots in enumerate(self.path_spots)]
+        self.tile_spots = [tuple(s for s, tiles in enumerate(self.spot_tiles) if t in tiles) if t < self.n_land else ()
+                           for t in range(self.n_tiles)]
+        self.tile_paths = [tuple(p for p, (s, s2) in enumerate(self.path_spots)
+                                 if t in self.spot_tiles[s] and t in self.spot_tiles[s2])
+                           for t in range(self.n_tiles)]
+
+        assert (self.n_tiles, self.n_land) == (37, 19), (self.n_tiles, self.n_land)
+        assert len(self.spot_tiles) == 54, len(self.spot_tiles)
+        assert len(self.path_spots) == 72, len(self.path_spots)
+        assert len(self.coastal) == 30, len(self.coastal)
+        assert all(len(self.tile_spots[t]) == 6 and len(self.tile_paths[t]) == 6 for t in range(self.n_land))
+        assert all(1 < len(neighbors) < 4 for neighbors in self.spot_neighbors)
+        assert all(1 < len(neighbors) < 5 for neighbors in self.path_neighbors)
+
+        # the same relations as arrays, for code that works on a board's state arrays all at once
+        self.tile_spot_array = array(self.tile_spots[:self.n_land])
+        self.spot_tile_array = array(self.spot_tiles)
+        self.path_spot_array = array(self.path_spots)
+        self.spot_adjacency = zeros((len(self.spot_tiles), len(self.spot_tiles)), dtype=bool)
+        for s, neighbors in enumerate(self.spot_neighbors):
+            self.spot_adjacency[s, list(neighbors)] = True
+        self.path_incidence = zeros((len(self.path_spots), len(self.spot_tiles)), dtype=bool)
+        for p, spots in enumerate(self.path_spots):
+            self.path_incidence[p, list(spots)] = True
+
+        # the coastal paths in order around the island, so harbors can be spaced out along it
+        self.coastal_ring = [self.coastal[0]]
+        while len(self.coastal_ring) < len(self.coastal):
+            self.coastal_ring.append(next(p for p in self.path_neighbors[self.coastal_ring[-1]]
+                                          if p in self.coastal and p not in self.coastal_ring[-2:]))
+        assert self.coastal_ring[0] in self.path_neighbors[self.coastal_ring[-1]]
+        self.coastal_ring = array(self.coastal_ring)
+
+        # every way to put the 6s and 8s on four land tiles that don't touch, and for each land tile the ways that
+        # leave it free for the desert, padded to the same length and counted
+        self.high_dice_sets = array([tiles for tiles in combinations(range(self.n_land), len(HIGH_DICE))
+                                     if not any(t2 in self.tile_neighbors[t] for t, t2 in combinations(tiles, 2))])
+        without = [flatnonzero((self.high_dice_sets != t).all(axis=1)) for t in range(self.n_land)]
+        self.high_dice_counts = array([len(sets) for sets in without])
+        self.high_dice_without = zeros((self.n_land, self.high_dice_counts.max()), dtype=int)
+        for t, sets in enumerate(without):
+            self.high_dice_without[t, :len(sets)] = sets
+
+
+TOPOLOGY = Topology()
+
+# The fine-grained action space, for agents with fine_actions set: every concrete move a player can make on their
+# turn, as consecutive ranges of action ids. Knights are played onto a land tile, monopolies name a resource and bank
+# trades are one (give, get) pair of resources each.
+ROAD_ACTIONS = range(len(TOPOLOGY.path_spots))
+SETTLEMENT_ACTIONS = range(ROAD_ACTIONS.stop, ROAD_ACTIONS.stop + len(TOPOLOGY.spot_tiles))
+CITY_ACTIONS = range(SETTLEMENT_ACTIONS.stop, SETTLEMENT_ACTIONS.stop + len(TOPOLOGY.spot_tiles))
+BUY_DEV_CARD_ACTION = CITY_ACTIONS.stop
+KNIGHT_ACTIONS = range(BUY_DEV_CARD_ACTION + 1, BUY_DEV_CARD_ACTION + 1 + TOPOLOGY.n_land)
+ROAD_BUILDING_ACTION = KNIGHT_ACTIONS.stop
+YEAR_OF_PLENTY_ACTION = ROAD_BUILDING_ACTION + 1
+MONOPOLY_ACTIONS = range(YEAR_OF_PLENTY_ACTION + 1, YEAR_OF_PLENTY_ACTION + 1 + len(RESOURCES))
+TRADES = tuple((give, get) for give in range(len(RESOURCES)) for get in range(len(RESOURCES)) if give != get)
+TRADE_ACTIONS = range(MONOPOLY_ACTIONS.stop, MONOPOLY_ACTIONS.stop + len(TRADES))
+PASS_ACTION = TRADE_ACTIONS.stop
+ACTIONS = PASS_ACTION + 1
+
+STATE_SIZE = 46  # what Player.get_state returns
+# what Player.get_observation returns: the state, both sides' buildings and roads, the robber, what each spot
+# produces and the player's bank rates
+OBSERVATION_SIZE = (STATE_SIZE + 2 * len(TOPOLOGY.spot_tiles) + 2 * len(TOPOLOGY.path_spots) + TOPOLOGY.n_land +
+                    len(TOPOLOGY.spot_tiles) + len(RESOURCES))
+
+
+# Legal road, settlement and city masks for one board or a whole stack of them. The arrays are a board's
+# path_owner, spot_owner and spot_level, optionally with leading batch dimensions; player and setup are
+# scalars or match those leading dimensions.
+def legal_moves(path_owner, spot_owner, spot_level, player, setup=False):
+    player = asarray(player)[..., None]
+    my_spots = spot_owner == player
+    built = spot_level > 0
+    on_my_road = (path_owner == player) @ TOPOLOGY.path_incidence
+    reachable = (on_my_road | my_spots) @ TOPOLOGY.path_incidence.T
+    blocked = (built & ~my_spots) @ TOPOLOGY.path_incidence.T
+    paths = reachable & ~blocked & (path_owner == NOBODY)
+    settlements = ~built & ~(built @ TOPOLOGY.spot_adjacency) & (on_my_road | asarray(setup)[..., None])
+    cities = (spot_level == 1) & my_spots
+    return paths, settlements, cities
+
+
+def legal_moves_batch(boards, players):
+    return legal_moves(stack([board.path_owner for board in boards]), stack([board.spot_owner for board in boards]),
+                       stack([board.spot_level for board in boards]), players, [board.turn <= 0 for board in boards])
+
+
+def action_mask(board, player):  # which of the ACTIONS the player can take on their turn
+    hand = board.resources[player.index]
+    has = hand > 0
+    brick, lumber, sheep, wheat, ore = (RESOURCE_INDEX[resource] for resource in STATE_RESOURCES)
+    paths, settlements, cities = board.legal_moves(player.index)
+    mask = zeros(ACTIONS, dtype=bool)
+    mask[ROAD_ACTIONS.start:ROAD_ACTIONS.stop] = paths & (has[brick] and has[lumber] and player.roads > 0)
+    mask[SETTLEMENT_ACTIONS.start:SETTLEMENT_ACTIONS.stop] = settlements & bool(
+        has[brick] and has[lumber] and has[sheep] and has[wheat] and player.settlements > 0)
+    mask[CITY_ACTIONS.start:CITY_ACTIONS.stop] = cities & bool(hand[ore] > 2 and hand[wheat] > 1 and player.cities > 0)
+    mask[BUY_DEV_CARD_ACTION] = has[sheep] and has[wheat] and has[ore] and sum(board.dev_cards.values()) > 0
+    if player.dev_cards["knight"]:
+        mask[KNIGHT_ACTIONS.start:KNIGHT_ACTIONS.stop] = arange(TOPOLOGY.n_land) != board.robber
+    mask[ROAD_BUILDING_ACTION] = player.dev_cards["road_building"] > 0 and player.roads > 0
+    mask[YEAR_OF_PLENTY_ACTION] = player.dev_cards["year_of_plenty"] > 0
+    mask[MONOPOLY_ACTIONS.start:MONOPOLY_ACTIONS.stop] = player.dev_cards["monopoly"] > 0
+    mask[TRADE_ACTIONS.start:TRADE_ACTIONS.stop] = (hand >= board.rates[player.index])[[give for give, _ in TRADES]]
+    mask[PASS_ACTION] = True
+    return mask
+
+
+class RoadNetwork:  # keeps every player's longest road up to date as roads and settlements are placed
+    def __init__(self, board):
+        self.board = board
+        self.component = full(len(TOPOLOGY.path_spots), -1, dtype="int16")  # which road component each road is in
+        self.lengths = [{} for _ in PLAYER_NAMES]  # component -> longest road in it, per player
+        self.longest = [0] * len(PLAYER_NAMES)
+        self.next_component = 0
+
+    def snapshot(self):
+        return self.component.copy(), [dict(lengths) for lengths in self.lengths], list(self.longest), \
+            self.next_component
+
+    def restore(self, snapshot):
+        component, lengths, longest, self.next_component = snapshot
+        self.component = component.copy()
+        self.lengths = [dict(lengths) for lengths in lengths]
+        self.longest = list(longest)
+
+    def blocked(self, player, spot):  # a road can't run through someone else's building
+        return self.board.spot_level[spot] > 0 and self.board.spot_owner[spot] != player
+
+    def road_built(self, player, path):
+        self.rebuild(player, [path])
+
+    def settlement_built(self, player, spot):
+        for owner in set(self.board.path_owner[list(TOPOLOGY.spot_paths[spot])]) - {NOBODY, player}:
+            self.rebuild(owner, [p for p in TOPOLOGY.spot_paths[spot] if self.board.path_owner[p] == owner])
+
+    def rebuild(self, player, paths):
+        done = set()
+        relabelled = set()  # ids given out in this rebuild, which a component split from the same old one can't reuse
+        for path in paths:
+            if path in done:
+                continue
+            component = self.component_of(player, path)
+            done |= component
+            old = set(self.component[list(component)].tolist()) - {-1} - relabelled
+            for label in old:
+                self.lengths[player].pop(label, None)
+            if old:  # reuse an id the component had, so ids stay within the roads that exist
+                label = min(old)
+            else:
+                label = self.next_component
+                self.next_component += 1
+            relabelled.add(label)
+            self.component[list(component)] = label
+            self.lengths[player][label] = self.longest_in(player, component)
+        self.longest[player] = max(self.lengths[player].values(), default=0)
+
+    def longest_with(self, player, path):  # the player's longest road if they also owned path
+        return max(self.longest[player], self.longest_in(player, self.component_of(player, path, path)))
+
+    def component_of(self, player, path, extra=None):
+        component = {path}
+        frontier = [path]
+        while frontier:
+            for spot in TOPOLOGY.path_spots[frontier.pop()]:
+                if self.blocked(player, spot):
+                    continue
+                for path2 in TOPOLOGY.spot_paths[spot]:
+                    if path2 not in component and (self.board.path_owner[path2] == player or path2 == extra):
+                        component.add(path2)
+                        frontier.append(path2)
+        return component
+
+    def longest_in(self, player, component):
+        spots = {spot for path in component for spot in TOPOLOGY.path_spots[path]}
+        return max(self.longest_from(player, spot, component, set()) for spot in spots)
+
+    def longest_from(self, player, spot, component, visited):
+        longest = 0
+        for path in TOPOLOGY.spot_paths[spot]:
+            if path in component and path not in visited:
+                spot2 = sum(TOPOLOGY.path_spots[path]) - spot
+                visited.add(path)
+                if self.blocked(player, spot2):
+                    longest = max(longest, 1)
                 else:
-                    self.tiles[pair] = Tile(*pair, "water", 7)
-            return increment
-
-        for i in range(6):
-            pair = cos(x * i), sin(x * i)
-            h += rgfdgfds(pair)
-            for j in range(6):
-                pair2 = pair[0] + cos(x * j), pair[1] + sin(x * j)
-                h += rgfdgfds(pair2)
-                for k in range(6):
-                    pair3 = pair2[0] + cos(x * k), pair2[1] + sin(x * k)
-                    h += rgfdgfds(pair3)
-        assert len(self.tiles) == 37, len(self.tiles)
-
-        self.tiles = list(self.tiles.values())
-        desert_tile = [tile for tile in self.tiles if tile.terrain_type == "desert"][0]
-        desert_tile.robber = True
-        self.robber = desert_tile
-
-        for tile in self.tiles:
-            for tile2 in self.tiles:
-                key = (tile2.a, tile2.b)
-                if (tile.a - tile2.a) ** 2 + (tile.b - tile2.b) ** 2 == 1:
-                    if key not in tile.neighbors:
-                        tile.neighbors[key] = tile2
-
-        ttl_neighbors = 0
-        for tile in self.tiles:
-            ttl_neighbors += len(tile.neighbors)
-        assert ttl_neighbors == 180, ttl_neighbors
-
-        self.tiles = [tile for tile in self.tiles if tile.terrain_type != "water"]
-
-        for tile in self.tiles:
-            assert len(tile.neighbors) == 6, len(tile.neighbors)
-
-        self.spots = {}
-        for tile in self.tiles:
-            for tile2 in tile.neighbors.values():
-                assert tile in tile2.neighbors.values(), (tile, tile2)
-                for tile3 in tile2.neighbors.values():
-                    assert tile2 in tile3.neighbors.values(), (tile2, tile3)
-                    if tile3 in tile.neighbors.values():
-                        key = mean([tile.a for tile in (tile, tile2, tile3)]), \
-                            mean([tile.b for tile in (tile, tile2, tile3)])
-                        if key not in self.spots:
-                            self.spots[key] = Spot(tile, tile2, tile3)
-                        tile.spots[key] = self.spots[key]
-            assert len(tile.spots) == 6, len(tile.spots)
-        assert len(self.spots) == 54, len(self.spots)
-
-        harbors = list(set(terrain_types)) + ["3:1"] * 4 + [None] * 21
-        harbors.remove("desert")
-        shuffle(harbors)
-        self.paths = {}
-        items = list(self.spots.items())
-        for name, spot in list(items):
-            if not spot.a:
-                spot.a, spot.b = name
-            for name2, spot2 in items:
-                if not spot2.a:
-                    spot2.a, spot2.b = name2
-                if len(set(spot.tiles).union(spot2.tiles)) == 4:
-                    if any(tile.terrain_type == "water" for tile in spot.tiles) and \
-                            any(tile.terrain_type == "water" for tile in spot2.tiles):
-                        harbor = harbors.pop()
-                    else:
-                        harbor = "N/A"
-                    key = mean([spot.a for spot in (spot, spot2)]), \
-                        mean([spot.b for spot in (spot, spot2)])
-                    if key not in self.paths:
-                        self.paths[key] = Path(key, harbor)
-                    path = self.paths[key]
-                    path.spots = (spot.a, spot.b), (spot2.a, spot2.b)
-                    spot.paths[key] = path
-                    spot2.paths[key] = path
-            items.pop(0)
-        assert len(self.paths) == 72, len(self.paths)
-
-        for spot in self.spots.values():
-            assert len(spot.paths) < 4, len(spot.paths)
-            assert len(spot.paths) > 1, len(spot.paths)
-            for key, spot2 in self.spots.items():
-                if len(set(spot.paths).union(spot2.paths)) < len(spot.paths) + len(spot2.paths) and spot != spot2:
-                    spot.neighbors[key] = spot2
-
-        for spot in self.spots.values():
-            assert len(spot.neighbors) < 4, len(spot.neighbors)
-            assert len(spot.neighbors) > 1, len(spot.neighbors)
-
-        for key, path in self.paths.items():
-            assert len(path.spots) == 2, len(path.spots)
-            spot, spot2 = path.spots
-            spot, spot2 = self.spots[spot], self.spots[spot2]
-            for tile in set(spot.tiles).intersection(spot2.tiles):
-                tile.paths[key] = path
-            for key2, path2 in self.paths.items():
-                if len(set(path.spots).union(path2.spots)) < len(path.spots) + len(path2.spots) and path != path2:
-                    path.neighbors[key2] = path2
-            path.a = (spot.a + spot2.a) / 2
-            path.b = (spot.b + spot2.b) / 2
-
-        for tile in self.tiles:
-            assert len(tile.paths) == 6, len(tile.paths)
-
-        for path in self.paths.values():
-            assert len(path.neighbors) < 5, len(path.neighbors)
-            assert len(path.neighbors) > 1, len(path.neighbors)
-
-        last_high_dice = {}
-        restricted_tiles = []
-        for tile in self.tiles:
-            # fix dice so that 6's and 8's are not next to each other
-            if tile.die in [6, 8]:
-                restricted_tiles.append(tile)
-                for tile2 in tile.neighbors.values():
-                    restricted_tiles.append(tile2)
-                    if tile2.die in [6, 8]:
-                        last_high_dice[tile2] = tile2.die
-                        tile2.die = None
-
-        shuffle(self.tiles)
-        bad_tiles = list(last_high_dice)
-        for tile in self.tiles:
-            if last_high_dice and tile not in restricted_tiles:
-                low_dice = tile.die
-                bad_tile = bad_tiles.pop()
-                tile.die = last_high_dice.pop(bad_tile)
-                bad_tile.die = low_dice
-
-        self.paths = list(self.paths.items())
-        while True:
-            shuffle(self.paths)
-            last_harbors = []
-            restricted_paths = []
-            for _, path in self.paths:
-                # fix harbors so that they are not next to each other
-                if path.harbor and path.harbor != "N/A":
-                    restricted_paths.append(path)
-                    for path2 in path.neighbors.values():
-                        restricted_paths.append(path2)
-                        if path2.harbor and path2.harbor != "N/A":
-                            last_harbors.append(path2.harbor)
-                            path2.harbor = None
-            if not last_harbors:
-                break
-            shuffle(self.paths)
-            for _, path in self.paths:
-                if last_harbors and (path not in restricted_paths) and (path.harbor != "N/A"):
-                    path.harbor = last_harbors.pop()
-        self.paths = dict(self.paths)
+                    longest = max(longest, 1 + self.longest_from(player, spot2, component, visited))
+                visited.remove(path)
+        return longest
+
+
+class StateEncoder:  # keeps the costly parts of every player's state current as the board changes
+    def __init__(self, board):
+        self.board = board
+        self.harbors = zeros(len(PLAYER_NAMES), dtype="int16")  # what Player.most_harbors counts
+        self.expected = zeros((len(PLAYER_NAMES), len(STATE_RESOURCES)))  # expected production of each resource
+        self.legal = zeros((len(PLAYER_NAMES), 3), dtype="int16")  # how many settlement, city and road spots are open
+        self.legal_setup = None  # the setup flag legal was counted with, or None once a build makes it stale
+
+    def snapshot(self):
+        return self.harbors.copy(), self.expected.copy(), self.legal.copy(), self.legal_setup
+
+    def restore(self, snapshot):
+        harbors, expected, legal, self.legal_setup = snapshot
+        self.harbors, self.expected, self.legal = harbors.copy(), expected.copy(), legal.copy()
+
+    def road_built(self, player, path):
+        if self.board.harbors[path] != NO_HARBOR:
+            self.harbors[player] += self.board.spot_level[list(TOPOLOGY.path_spots[path])].sum()
+        self.legal_setup = None
+
+    def building_placed(self, player, spot):
+        for p in TOPOLOGY.spot_paths[spot]:
+            if self.board.harbors[p] != NO_HARBOR and self.board.path_owner[p] != NOBODY:
+                self.harbors[self.board.path_owner[p]] += 1
+        for t in TOPOLOGY.spot_tiles[spot]:
+            if t < TOPOLOGY.n_land and self.board.terrain[t] < len(RESOURCES):
+                resource = STATE_RESOURCES.index(RESOURCES[self.board.terrain[t]])
+                self.expected[player, resource] += self.board.probability[t]
+        self.legal_setup = None
+
+    def self_states(self):  # one row per player, the same as Player.get_self_state
+        setup = self.board.turn <= 0
+        if self.legal_setup is not setup:
+            paths, settlements, cities = legal_moves(self.board.path_owner, self.board.spot_owner,
+                                                     self.board.spot_level, arange(len(PLAYER_NAMES)), setup)
+            self.legal = column_stack([settlements.sum(axis=1), cities.sum(axis=1), paths.sum(axis=1)])
+            self.legal_setup = setup
+        players = self.board.players
+        counts = array([[player.knights, player.longest_road(), player.most_harbors(), player.largest_army()]
+                        for player in players])
+        pieces = array([[player.settlements, player.cities, player.roads] for player in players])
+        dev_cards = array([list(player.dev_cards.values()) for player in players])
+        return column_stack([counts, self.board.resources, pieces, self.legal, self.expected, dev_cards])
+
+    def state(self, player):
+        states = self.self_states()
+        mean_state = states.mean(axis=0)
+        return concatenate([states[player], mean_state[:-5], [mean_state[-5:].sum()]]).tolist()
+
+
+class Layout(namedtuple("Layout", ["terrain", "dice", "harbors"])):  # one board's layout, or a stack of them
+    def split(self):
+        return [Layout(*row) for row in zip(*self)]
+
+
+# Samples layouts that keep 6s and 8s apart and harbors apart without retrying: the 6s and 8s go on one of the
+# precomputed sets of tiles that don't touch, and the harbors are spread around the coast with at least one path
+# between each, as a random way of splitting the free paths into nine gaps plus a random rotation. Given the shuffled
+# terrain, every valid placement of the dice and of the harbors is equally likely. All the layouts are made at once,
+# from a numpy Generator.
+def random_layouts(n_layouts, rng):
+    rows = arange(n_layouts)[:, None]
+    land = TOPOLOGY.n_land
+    terrain = LAND_TERRAIN[argsort(rng.random((n_layouts, land)), axis=1)]
+    desert = argmax(terrain == TERRAINS.index("desert"), axis=1)
+
+    sets = (rng.random(n_layouts) * TOPOLOGY.high_dice_counts[desert]).astype(int)
+    high = TOPOLOGY.high_dice_sets[TOPOLOGY.high_dice_without[desert, sets]]
+    keys = rng.random((n_layouts, land))  # sorts the high tiles first and the desert last, each part shuffled
+    keys[rows, high] -= 2
+    keys[rows[:, 0], desert] += 2
+    dice = zeros((n_layouts, land), dtype="int8")
+    put_along_axis(dice, argsort(keys, axis=1), LAND_DICE, axis=1)
+
+    ring = len(TOPOLOGY.coastal_ring)
+    n_harbors = len(HARBOR_KINDS)
+    gaps = sort(argsort(rng.random((n_layouts, ring - n_harbors - 1)), axis=1)[:, :n_harbors - 1] + 1, axis=1)
+    positions = concatenate([zeros((n_layouts, 1), dtype=int), gaps + arange(1, n_harbors)], axis=1)
+    positions = (positions + rng.integers(ring, size=(n_layouts, 1))) % ring
+    harbors = full((n_layouts, len(TOPOLOGY.path_spots)), NO_HARBOR, dtype="int8")
+    harbors[rows, TOPOLOGY.coastal_ring[positions]] = HARBOR_KINDS[argsort(rng.random((n_layouts, n_harbors)), axis=1)]
+
+    water = TOPOLOGY.n_tiles - land
+    return Layout(concatenate([terrain, full((n_layouts, water), TERRAINS.index("water"), dtype="int8")], axis=1),
+                  concatenate([dice, full((n_layouts, water), 7, dtype="int8")], axis=1), harbors)
+
+
+class NullProfiler:  # what boards time the phases of their turns with unless given a profiling.Profiler
+    def phase(self, name):
+        return NULL_PHASE
+
+
+NULL_PHASE = nullcontext()
+NULL_PROFILER = NullProfiler()
+
+# Everything about a board that a game changes, plus its layout, in a fixed 442 bytes. The caches kept from these
+# (production, exchange rates, road network, encoder) are rebuilt on load, and nothing in the Tile/Spot/Path views
+# is stored. Dev cards are in DEV_CARDS order, awards are (seat, size) with a seat of NOBODY for none, and the
+# per-seat fields only mean anything once the board is seated.
+DEV_CARDS = ("knight", "victory_point", "road_building", "year_of_plenty", "monopoly")
+BOARD_RECORD = dtype([
+    ("terrain", "i1", (TOPOLOGY.n_tiles,)), ("dice", "i1", (TOPOLOGY.n_tiles,)),
+    ("harbors", "i1", (len(TOPOLOGY.path_spots),)), ("robber", "i1"),
+    ("spot_owner", "i1", (len(TOPOLOGY.spot_tiles),)), ("spot_level", "i1", (len(TOPOLOGY.spot_tiles),)),
+    ("path_owner", "i1", (len(TOPOLOGY.path_spots),)), ("resources", "<i2", (len(PLAYER_NAMES), len(RESOURCES))),
+    ("dev_cards", "i1", (len(DEV_CARDS),)), ("turn", "<i2"), ("current", "i1"), ("awards", "i1", (3, 2)),
+    ("is_game_over", "?"), ("winner", "i1"), ("final_turn", "<i2"), ("seated", "?"),
+    ("pieces", "i1", (len(PLAYER_NAMES), 3)), ("player_dev_cards", "i1", (len(PLAYER_NAMES), len(DEV_CARDS))),
+    ("knights", "i1", (len(PLAYER_NAMES),)), ("victory_points", "i1", (len(PLAYER_NAMES), 2)),
+    ("won", "?", (len(PLAYER_NAMES),)), ("offers", "i1", (len(PLAYER_NAMES), 2)),
+])
+
+
+class Board:
+    def __init__(self, seed=None, profiler=None, layout=None):  # a layout from random_layouts, or a random one
+        self.rng = Random(seed)  # everything random in this game draws from here, so a seed replays it exactly
+        self.profiler = profiler or NULL_PROFILER
+        if layout is None:
+            layout = random_layouts(1, default_rng(self.rng.getrandbits(64))).split()[0]
+        self.terrain, self.dice, self.harbors = layout
+        self.robber = int(flatnonzero(self.terrain == TERRAINS.index("desert"))[0])
+        self.probability = DIE_PROBABILITY[self.dice]
+        self.spot_value = self.probability[TOPOLOGY.spot_tile_array].sum(axis=1)  # how often each spot produces
+        self.mask = None  # the legal actions of the player deciding, if their agent uses fine-grained actions
+
+        self.spot_owner = full(len(TOPOLOGY.spot_tiles), NOBODY, dtype="int8")
+        self.spot_level = zeros(len(TOPOLOGY.spot_tiles), dtype="int8")
+        self.path_owner = full(len(TOPOLOGY.path_spots), NOBODY, dtype="int8")
+        self.road_network = RoadNetwork(self)
+
+        # what each dice total pays out to each player, kept current as buildings and the robber move
+        self.resources = zeros((len(PLAYER_NAMES), len(RESOURCES)), dtype="int16")
+        self.production = zeros((13, len(PLAYER_NAMES), len(RESOURCES)), dtype="int16")
+        self.encoder = StateEncoder(self)
+
+        # how many of a resource each player gives the bank for one card, lowered as they settle on harbors, and each
+        # player's standing offer to the others as (resource given, resource wanted)
+        self.rates = full((len(PLAYER_NAMES), len(RESOURCES)), 4, dtype="int8")
+        self.offers = full((len(PLAYER_NAMES), 2), NO_RESOURCE, dtype="int8")
+
+        # Tile/Spot/Path views are only made if something asks for them, e.g. plot
+        self._views = None
 
         self.dev_cards = {"knight": 14, "victory_point": 5, "road_building": 2, "year_of_plenty": 2, "monopoly": 2}
 
@@ -293,14 +605,213 @@ class Board:
 
         self.players: list[Player] = []
 
+        self.current = 0  # whose turn it is within the round
+
         self.winner = None
 
         self.final_turn = None
 
-        self.prev_state = None
-
         # self.plot()
 
+    # Everything a game changes, copied out of the arrays without touching the object graph. Awards and the winner
+    # are kept as seat numbers so a snapshot can be restored onto a clone. The random number stream isn't included,
+    # so lookahead from the same snapshot keeps rolling differently.
+    def snapshot(self):
+        awards = [award and (award[0].index, award[1]) for award in
+                  (self.player_with_longest_road, self.player_with_largest_army, self.player_with_most_harbors)]
+        return (self.spot_owner.copy(), self.spot_level.copy(), self.path_owner.copy(), self.resources.copy(),
+                self.production.copy(), self.rates.copy(), self.offers.copy(), self.robber,
+                self.road_network.snapshot(), self.encoder.snapshot(), dict(self.dev_cards), self.turn, self.current,
+                awards, self.is_game_over, self.winner and self.winner.index, self.final_turn,
+                [player.snapshot() for player in self.players])
+
+    def restore(self, snapshot):
+        (spot_owner, spot_level, path_owner, resources, production, rates, offers, self.robber, road_network, encoder,
+         dev_cards, self.turn, self.current, awards, self.is_game_over, winner, self.final_turn, players) = snapshot
+        self.spot_owner, self.spot_level, self.path_owner = spot_owner.copy(), spot_level.copy(), path_owner.copy()
+        self.resources, self.production = resources.copy(), production.copy()
+        self.rates, self.offers = rates.copy(), offers.copy()
+        self.road_network.restore(road_network)
+        self.encoder.restore(encoder)
+        self.dev_cards = dict(dev_cards)
+        self.player_with_longest_road, self.player_with_largest_army, self.player_with_most_harbors = \
+            [award and (self.players[award[0]], award[1]) for award in awards]
+        self.winner = None if winner is None else self.players[winner]
+        for player, snapshot in zip(self.players, players):
+            player.restore(snapshot)
+
+    def clone(self):  # an independent copy of the game that shares the layout arrays, which never change
+        board = copy(self)
+        board.rng = copy(self.rng)  # the same stream from here on, but drawn from separately
+        board._views = None
+        board.road_network = RoadNetwork(board)
+        board.encoder = StateEncoder(board)
+        board.players = [player.clone(board) for player in self.players]
+        board.restore(self.snapshot())
+        return board
+
+    # The game as a BOARD_RECORD, without the random number stream or the players' histories and agents.
+    def to_record(self):
+        record = zeros((), dtype=BOARD_RECORD)
+        for name in ("terrain", "dice", "harbors", "robber", "spot_owner", "spot_level", "path_owner", "resources",
+                     "offers", "turn", "current", "is_game_over"):
+            record[name] = getattr(self, name)
+        record["dev_cards"] = [self.dev_cards[card] for card in DEV_CARDS]
+        awards = self.player_with_longest_road, self.player_with_largest_army, self.player_with_most_harbors
+        record["awards"] = [(award[0].index, award[1]) if award else (NOBODY, 0) for award in awards]
+        record["winner"] = NOBODY if self.winner is None else self.winner.index
+        record["final_turn"] = -1 if self.final_turn is None else self.final_turn
+        record["seated"] = bool(self.players)
+        for player in self.players:
+            record["pieces"][player.index] = player.roads, player.settlements, player.cities
+            record["player_dev_cards"][player.index] = [player.dev_cards[card] for card in DEV_CARDS]
+            record["knights"][player.index] = player.knights
+            record["victory_points"][player.index] = player.victory_points, player.prev_victory_points
+            record["won"][player.index] = player.won
+        return record
+
+    def to_bytes(self):
+        return self.to_record().tobytes()
+
+    @classmethod
+    def from_record(cls, record, agent=None, seed=None, profiler=None):  # a seated record is given agent's seats
+        board = cls(seed, profiler, Layout(array(record["terrain"]), array(record["dice"]), array(record["harbors"])))
+        board.robber = int(record["robber"])
+        board.spot_owner[:] = record["spot_owner"]
+        board.spot_level[:] = record["spot_level"]
+        board.path_owner[:] = record["path_owner"]
+        board.resources[:] = record["resources"]
+        board.offers[:] = record["offers"]
+        board.dev_cards = {card: int(count) for card, count in zip(DEV_CARDS, record["dev_cards"])}
+        board.turn, board.current = int(record["turn"]), int(record["current"])
+        board.is_game_over = bool(record["is_game_over"])
+        board.final_turn = None if record["final_turn"] < 0 else int(record["final_turn"])
+        if record["seated"]:
+            board.seat(agent)
+            for player in board.players:
+                player.roads, player.settlements, player.cities = record["pieces"][player.index].tolist()
+                player.dev_cards = {card: int(record["player_dev_cards"][player.index][DEV_CARDS.index(card)])
+                                    for card in player.dev_cards}
+                player.knights = int(record["knights"][player.index])
+                player.victory_points, player.prev_victory_points = record["victory_points"][player.index].tolist()
+                player.won = bool(record["won"][player.index])
+            board.player_with_longest_road, board.player_with_largest_army, board.player_with_most_harbors = \
+                [None if seat == NOBODY else (board.players[seat], int(size)) for seat, size in record["awards"]]
+            board.winner = None if record["winner"] == NOBODY else board.players[record["winner"]]
+        board.recompute()
+        return board
+
+    @classmethod
+    def from_bytes(cls, data, agent=None, seed=None, profiler=None):
+        return cls.from_record(frombuffer(data, dtype=BOARD_RECORD)[0], agent, seed, profiler)
+
+    def recompute(self):  # rebuild everything kept incrementally from the ownership arrays, e.g. after loading
+        self.production[:] = 0
+        self.rates[:] = 4
+        self.road_network = RoadNetwork(self)
+        self.encoder = StateEncoder(self)
+        for player in range(len(PLAYER_NAMES)):
+            self.road_network.rebuild(player, flatnonzero(self.path_owner == player).tolist())
+        for spot in flatnonzero(self.spot_level).tolist():
+            self.add_production(spot, self.spot_owner[spot], self.spot_level[spot])
+            self.open_harbors(self.spot_owner[spot], spot)
+            for _ in range(self.spot_level[spot]):  # the encoder counts each level as it was built
+                self.encoder.building_placed(self.spot_owner[spot], spot)
+
+    def views(self):
+        if self._views is None:
+            self._views = ([Tile(self, t) for t in range(TOPOLOGY.n_tiles)],
+                           [Spot(self, s) for s in range(len(TOPOLOGY.spot_tiles))],
+                           [Path(self, p) for p in range(len(TOPOLOGY.path_spots))])
+        return self._views
+
+    def add_production(self, spot, player, levels):
+        for t in TOPOLOGY.spot_tiles[spot]:
+            if t < TOPOLOGY.n_land and self.terrain[t] < len(RESOURCES) and t != self.robber:
+                self.production[self.dice[t], player, self.terrain[t]] += levels
+
+    def toggle_production(self, tile, sign):
+        if self.terrain[tile] < len(RESOURCES):
+            for s in TOPOLOGY.tile_spots[tile]:
+                if self.spot_owner[s] != NOBODY:
+                    yields = sign * self.spot_level[s]
+                    self.production[self.dice[tile], self.spot_owner[s], self.terrain[tile]] += yields
+
+    def place_road(self, player, path):
+        self.path_owner[path] = player
+        self.road_network.road_built(player, path)
+        self.encoder.road_built(player, path)
+
+    def place_building(self, player, spot):  # a settlement on an empty spot, or a city on the player's settlement
+        self.spot_owner[spot] = player
+        self.spot_level[spot] += 1
+        self.add_production(spot, player, 1)
+        if self.spot_level[spot] == 1:
+            self.road_network.settlement_built(player, spot)
+            self.open_harbors(player, spot)
+        self.encoder.building_placed(player, spot)
+
+    def open_harbors(self, player, spot):  # a building next to a harbor lets its owner trade there
+        for p in TOPOLOGY.spot_paths[spot]:
+            harbor = self.harbors[p]
+            if harbor == HARBORS.index("3:1"):
+                self.rates[player] = self.rates[player].clip(max=3)
+            elif harbor != NO_HARBOR:
+                self.rates[player, harbor] = 2
+
+    def trade_with_bank(self, player, give, get):
+        self.resources[player, give] -= self.rates[player, give]
+        self.resources[player, get] += 1
+
+    def offer(self, player, give, want):  # stands until it's taken or the player makes another
+        self.offers[player] = give, want
+
+    # Trades one card each way between every pair of players whose standing offers mirror each other and who still
+    # hold what they offered, all at once after each turn. Seats earlier in the order are paired first.
+    def resolve_offers(self):
+        give, want = self.offers[:, 0], self.offers[:, 1]
+        able = (give != NO_RESOURCE) & (self.resources[arange(len(give)), give] > 0)
+        matches = able[:, None] & able[None, :] & (give[:, None] == want[None, :]) & (want[:, None] == give[None, :])
+        for player, other in zip(*matches.nonzero()):
+            if player < other and self.offers[player, 0] != NO_RESOURCE and self.offers[other, 0] != NO_RESOURCE:
+                self.resources[player, give[player]] -= 1
+                self.resources[other, give[player]] += 1
+                self.resources[other, give[other]] -= 1
+                self.resources[player, give[other]] += 1
+                self.offers[[player, other]] = NO_RESOURCE
+
+    def place_robber(self, tile):
+        self.toggle_production(self.robber, 1)
+        self.robber = tile
+        self.toggle_production(tile, -1)
+
+    def legal_moves(self, player):
+        return legal_moves(self.path_owner, self.spot_owner, self.spot_level, player, self.turn <= 0)
+
+    @property
+    def tile_views(self):
+        return self.views()[0]
+
+    @property
+    def spot_views(self):
+        return self.views()[1]
+
+    @property
+    def path_views(self):
+        return self.views()[2]
+
+    @property
+    def tiles(self):
+        return self.tile_views[:TOPOLOGY.n_land]
+
+    @property
+    def spots(self):
+        return {(spot.a, spot.b): spot for spot in self.spot_views}
+
+    @property
+    def paths(self):
+        return {(path.a, path.b): path for path in self.path_views}
+
     def longest_road(self):
         longest_roads = [player.longest_road() for player in self.players]
         longest_road = max(longest_roads)
@@ -340,8 +851,12 @@ class Board:
                 self.player_with_most_harbors[0].victory_points += 2
         return most_harbor
 
+    def seat(self, agent):  # one agent for every seat, or a list with one per seat
+        agents = agent if isinstance(agent, (list, tuple)) else [agent] * len(PLAYER_NAMES)
+        self.players = [Player(i, self, agent) for i, agent in enumerate(agents)]
+
     def setup(self, agent):
-        self.players = [Player(name, self, agent) for name in ["red", "green", "blue", "yellow"]]
+        self.seat(agent)
         for player in self.players:
             player.build_settlement()
             player.build_road()
@@ -351,38 +866,94 @@ class Board:
             player.build_road()  # pretend you can put two roads on one settlement
         self.turn += 1
 
-    def play(self):
-        while not self.is_game_over:
-            stop = 0
-            for player in self.players:
-                stop += 1
-                player.roll()
+    def begin_turn(self):
+        with self.profiler.phase("roll"):
+            self.players[self.current].roll()
+
+    def observe(self):  # start the current player's turn and return the state they decide from
+        self.begin_turn()
+        player = self.players[self.current]
+        if getattr(player.agent, "fine_actions", False):
+            with self.profiler.phase("encode"):
+                player.states.append(player.get_observation())
+            with self.profiler.phase("mask"):
+                self.mask = action_mask(self, player)
+                player.masks.append(self.mask)
+        else:
+            with self.profiler.phase("encode"):
                 player.states.append(player.get_state())
-                player.move(player.agent.get_action(player.states[-1]))
-                player.prev_victory_points = player.victory_points
-                self.longest_road()
-                self.largest_army()
-                self.most_harbors()
-                self.is_game_over = player.victory_points >= 11
-                if self.is_game_over:
-                    self.winner = player
-                    player.won = True
-                    self.final_turn = self.turn
-                    break
-                stop = stop % len(self.players)
-            for player in self.players:
-                if not stop:
-                    break
+        return player.states[-1]
+
+    def decide(self, state):  # ask the current player's agent; agents that search are shown the board as well
+        agent = self.players[self.current].agent
+        with self.profiler.phase("inference"):
+            if getattr(agent, "sees_board", False):
+                return agent.get_action(state, self)
+            if getattr(agent, "fine_actions", False):
+                return agent.get_action(state, self.mask)
+            return agent.get_action(state)
+
+    def act(self, distribution):  # finish the current player's turn with their agent's action distribution
+        with self.profiler.phase("action"):
+            self.players[self.current].move(distribution)
+        return self.end_turn()
+
+    def apply(self, action):  # finish the current player's turn with a chosen action from their action space
+        player = self.players[self.current]
+        with self.profiler.phase("action"):
+            if getattr(player.agent, "fine_actions", False):
+                player.take(action)
+            else:
+                player.execute(action)
+        return self.end_turn()
+
+    def end_turn(self):
+        player = self.players[self.current]
+        player.prev_victory_points = player.victory_points
+        with self.profiler.phase("longest_road"):
+            self.longest_road()
+        with self.profiler.phase("largest_army"):
+            self.largest_army()
+        with self.profiler.phase("most_harbors"):
+            self.most_harbors()
+        with self.profiler.phase("trade"):
+            self.resolve_offers()
+        self.is_game_over = player.victory_points >= 11
+        if self.is_game_over:
+            self.winner = player
+            player.won = True
+            self.final_turn = self.turn
+        self.current += 1
+        if self.is_game_over or self.current == len(self.players):
+            for player in self.players[:self.current]:
                 player.rewards.append(player.get_reward())
-                stop -= 1
+            self.current = 0
             self.turn += 1
-            print(f"Turn {self.turn} complete, {[player.victory_points for player in self.players]}")
-        self.plot()
+        return self.is_game_over
+
+    def play(self, verbose=False, render=False):
+        while not self.is_game_over:
+            turn = self.turn
+            self.act(self.decide(self.observe()))
+            if verbose and self.turn != turn:
+                print(f"Turn {self.turn} complete, {[player.victory_points for player in self.players]}")
+        if render:
+            self.plot()
         return [state for player in self.players for state in player.states], \
             [action for player in self.players for action in player.actions], \
             [reward for player in self.players for reward in player.rewards]
 
+    def trajectory(self):
+        masks = [mask for player in self.players for mask in player.masks]
+        return Trajectory(array([state for player in self.players for state in player.states], dtype="float32"),
+                          array([action for player in self.players for action in player.actions], dtype="int64"),
+                          array([reward for player in self.players for reward in player.rewards], dtype="float32"),
+                          self.final_turn, self.winner.index, stack(masks) if masks else None,
+                          array([len(player.actions) for player in self.players], dtype="int64"))
+
     def plot(self):
+        import matplotlib.pyplot as plt  # only needed when something is drawn
+
         plt.figure(figsize=(5, 5))
         harbor_colors = {"ore": "lavender", "brick": "firebrick", "wheat": "lemonchiffon", "lumber": "olive",
                          "sheep": "lightgreen", "3:1": "deepskyblue", None: UNOWNED, "desert": "orange", "N/A": UNOWNED}
@@ -410,6 +981,82 @@ class Board:
         plt.show()
 
 
+# masks holds the legal actions at each decision when the players used fine-grained actions, and is None otherwise;
+# the players' transitions follow one another, and lengths holds how many each of them has
+Trajectory = namedtuple("Trajectory", ["states", "actions", "rewards", "final_turn", "winner", "masks", "lengths"],
+                        defaults=(None, None))
+
+
+class RandomAgent:  # weighs every action equally: the simplest baseline, and one that needs no torch
+    def get_action(self, state):
+        return full(INSTRUCTIONS, 1 / INSTRUCTIONS)
+
+    def get_actions(self, states):  # one uniform distribution per row of states
+        return full((len(states), INSTRUCTIONS), 1 / INSTRUCTIONS)
+
+
+def game_seeds(seed, n_games):  # independent seeds for a run of games, or fresh entropy for each if seed is None
+    if seed is None:
+        return [None] * n_games
+    return [int(child.generate_state(1, dtype="uint64")[0]) for child in SeedSequence(seed).spawn(n_games)]
+
+
+class GameBatch:  # plays many games in lockstep so that the agent decides for all of them at once
+    def __init__(self, n_games, agent, seed=None, profiler=None):
+        self.agent = agent
+        self.profiler = profiler or NULL_PROFILER
+        self.boards = [Board(seed, profiler) for seed in game_seeds(seed, n_games)]
+        for board in self.boards:
+            board.setup(agent)
+
+    def step(self):
+        boards = [board for board in self.boards if not board.is_game_over]
+        if boards:
+            states = array([board.observe() for board in boards], dtype="float32")
+            with self.profiler.phase("inference"):
+                if getattr(self.agent, "fine_actions", False):
+                    distributions = self.agent.get_actions(states, stack([board.mask for board in boards]))
+                else:
+                    distributions = self.agent.get_actions(states)
+            for board, distribution in zip(boards, distributions):
+                board.act(distribution)
+        return len(boards)
+
+    def play(self):
+        while self.step():
+            pass
+        return [board.trajectory() for board in self.boards]
+
+
+def simulate(n_games, agent, seed=None, verbose=False, render=False, batch=False, profiler=None):
+    if batch:  # the agent needs a get_actions that takes a whole array of states
+        return GameBatch(n_games, agent, seed, profiler).play()
+    trajectories = []
+    for seed in game_seeds(seed, n_games):
+        board = Board(seed, profiler)
+        board.setup(agent)
+        board.play(verbose, render)
+        trajectories.append(board.trajectory())
+    return trajectories
+
+
+def save_boards(path, boards):  # many boards as one .npy file of BOARD_RECORDs
+    records = zeros(len(boards), dtype=BOARD_RECORD)
+    for i, board in enumerate(boards):
+        records[i] = board.to_record()
+    save(path, records)
+
+
+def load_records(path, mmap=True):  # memory-mapped by default, so a large file is only read as records are used
+    return load(path, mmap_mode="r" if mmap else None)
+
+
+def load_boards(path, agent=None, seed=None):  # every board in a file; each gets its own seed from seed
+    records = load_records(path)
+    return [Board.from_record(record, agent, game_seed)
+            for record, game_seed in zip(records, game_seeds(seed, len(records)))]
+
+
 def idealize(choices, ideal):
     ideal_choices = [c for c in choices if ideal(c)]
     if ideal_choices:
@@ -418,12 +1065,13 @@ def idealize(choices, ideal):
 
 
 class Player:
-    def __init__(self, name, board, agent):
+    def __init__(self, index, board, agent):
         self.agent = agent
         self.won = False
-        self.name = name
+        self.index = index  # what the board's owner arrays hold for this player
+        self.name = PLAYER_NAMES[index]
         self.board = board
-        self.resources = {"ore": 0, "brick": 0, "wheat": 0, "lumber": 0, "sheep": 0}
+        self.resources = Hand(board, index)
         self.roads = 15
         self.settlements = 5
         self.cities = 4
@@ -434,79 +1082,74 @@ class Player:
         self.states = []
         self.actions = []
         self.rewards = []
+        self.masks = []
+
+    def snapshot(self):
+        return (self.roads, self.settlements, self.cities, dict(self.dev_cards), self.knights,
+                self.prev_victory_points, self.victory_points, self.won, len(self.states), len(self.actions),
+                len(self.rewards), len(self.masks))
+
+    def restore(self, snapshot):
+        (self.roads, self.settlements, self.cities, dev_cards, self.knights, self.prev_victory_points,
+         self.victory_points, self.won, states, actions, rewards, masks) = snapshot
+        self.dev_cards = dict(dev_cards)
+        del self.states[states:], self.actions[actions:], self.rewards[rewards:], self.masks[masks:]
+
+    def clone(self, board):
+        player = copy(self)
+        player.board = board
+        player.resources = Hand(board, self.index)
+        player.states, player.actions, player.rewards = list(self.states), list(self.actions), list(self.rewards)
+        player.masks = list(self.masks)
+        return player
 
     def available_paths(self):
-        paths = [path for name, path in self.board.paths.items() if
-                 (any([self.board.paths[path2].owner == self.name for path2 in path.neighbors]) or
-                  any([self.board.spots[spot].owner == self.name for spot in path.spots]))
-                 and path.owner == UNOWNED]
-        for path in paths:
-            for spot in path.spots:
-                if self.board.spots[spot].build_level > 0 and self.board.spots[spot].owner != self.name:
-                    paths.remove(path)
-                    break
-        return paths
+        return flatnonzero(self.board.legal_moves(self.index)[0]).tolist()
 
     def available_spots_for_settlement(self):
-        spots = []
-        for _, spot in self.board.spots.items():
-            if spot.build_level == 0 and \
-                    (any([path.owner == self.name for path in spot.paths.values()]) or self.board.turn <= 0) and \
-                    not any([i.build_level > 0 for i in spot.neighbors.values()]):
-                spots.append(spot)
-        return spots
+        return flatnonzero(self.board.legal_moves(self.index)[1]).tolist()
 
     def available_spots_for_city(self):
-        spots = []
-        for _, spot in self.board.spots.items():
-            if spot.build_level == 1 and spot.owner == self.name:
-                spots.append(spot)
-        return spots
+        return flatnonzero(self.board.legal_moves(self.index)[2]).tolist()
 
     def choose_tile_to_occupy(self):
-        most_vp = self.board.players[argmax([player.victory_points for player in self.board.players])]
-        tiles = idealize([tile for tile in self.board.tiles if not tile.robber],
-                         lambda tile: all(spot.owner != self.name for spot in tile.spots.values()))
-        tiles = idealize(tiles, lambda tile: any(spot.owner != UNOWNED for spot in tile.spots.values()))
-        tiles = idealize(tiles, lambda tile: tile.die in [6, 8] or
-                                             any(spot.owner == most_vp.name for spot in tile.spots.values()))
-        shuffle(tiles)
-        return tiles[argmax([tile.probability for tile in tiles])]
+        most_vp = argmax([player.victory_points for player in self.board.players])
+        owners = self.board.spot_owner[TOPOLOGY.tile_spot_array]
+        tiles = idealize([t for t in range(TOPOLOGY.n_land) if t != self.board.robber],
+                         lambda t: all(owners[t] != self.index))
+        tiles = idealize(tiles, lambda t: any(owners[t] != NOBODY))
+        tiles = idealize(tiles, lambda t: self.board.dice[t] in [6, 8] or any(owners[t] == most_vp))
+        self.board.rng.shuffle(tiles)
+        return tiles[argmax([self.board.probability[t] for t in tiles])]
 
     def choose_resource(self, exclude=None):
-        return choice([resource for resource in self.resources if self.resources[resource] == min(
+        return self.board.rng.choice([resource for resource in self.resources if self.resources[resource] == min(
             [v for k, v in self.resources.items() if k != exclude]) and resource != exclude])
 
     def drop_resources(self, n):
         resources = flatten_counts(self.resources)
         for _ in range(n):
-            resources.remove(choice(resources))
+            resources.remove(self.board.rng.choice(resources))
 
     def choose_path_to_build(self):
         if not (self.roads and ((self.resources["brick"] and self.resources["lumber"]) or self.board.turn <= 0)):
             return
         paths = self.available_paths()
         if paths:
-            ideal = lambda path: (all(spot.owner in UNOWNED for spot in [self.board.spots[name] for name in path.spots])
-                                  and any(all(self.board.spots[name].owner == UNOWNED for name in path2.spots) for path2
-                                          in path.neighbors.values()))
+            unowned = self.board.spot_owner == NOBODY
+            ideal = lambda p: (all(unowned[s] for s in TOPOLOGY.path_spots[p])
+                               and any(all(unowned[s] for s in TOPOLOGY.path_spots[p2])
+                                       for p2 in TOPOLOGY.path_neighbors[p]))
             paths = idealize(paths, ideal)
-            optimal_paths = []
             length = self.longest_road()
-            for path in paths:
-                if path.owner == UNOWNED:
-                    owner = path.owner
-                    path.owner = self.name
-                    if self.longest_road() > length:
-                        optimal_paths.append(path)
-                    path.owner = owner
-                if optimal_paths:
-                    paths = optimal_paths
-                return choice(paths)
+            optimal_paths = [p for p in paths if self.board.road_network.longest_with(self.index, p) > length]
+            if optimal_paths:
+                paths = optimal_paths
+            return self.board.rng.choice(paths)
 
     def total_production(self):
-        return sum(spot.build_level * tile.probability for spot in self.board.spots.values()
-                   if spot.owner == self.name for tile in spot.tiles)
+        mine = self.board.spot_owner == self.index
+        return (self.board.spot_level[mine] * self.board.probability[TOPOLOGY.spot_tile_array[mine]].sum(axis=1)).sum()
 
     def choose_spot_to_build(self):
         if not (self.settlements and ((self.resources["brick"] and self.resources["lumber"] and
@@ -514,31 +1157,30 @@ class Player:
             return
         spots = self.available_spots_for_settlement()
         if spots:
-            shuffle(spots)
+            self.board.rng.shuffle(spots)
             ttl_prod = self.most_harbors() * self.total_production()
-            return spots[argmax([sum(tile.probability for tile in spot.tiles) +
-                                 ttl_prod * any(
-                path.harbor and path.harbor != "N/A" for path in spot.paths.values())
-                                 for spot in spots])]
+            on_harbor = (self.board.harbors != NO_HARBOR) @ TOPOLOGY.path_incidence
+            return spots[argmax([self.board.probability[TOPOLOGY.spot_tile_array[s]].sum() + ttl_prod * on_harbor[s]
+                                 for s in spots])]
 
     def choose_spot_to_upgrade(self):
         if not (self.cities and self.resources["ore"] >= 3 and self.resources["wheat"]):
             return
         spots = self.available_spots_for_city()
         if spots:
-            return choice(spots)
+            return self.board.rng.choice(spots)
 
     def choose_dev_card(self):
         cards = [card for card in self.dev_cards if self.dev_cards[card] > 0 and card != "victory_point"]
         if cards:
-            return choice(cards)
+            return self.board.rng.choice(cards)
 
     def choose_person_to_steal_from(self, tile):
+        owners = self.board.spot_owner[TOPOLOGY.tile_spot_array[tile]]
         people = [player for player in self.board.players if
-                  (player.name != self.name) and sum(player.resources.values()) and (
-                          player.name in [spot.owner for spot in tile.spots.values()])]
+                  (player.index != self.index) and sum(player.resources.values()) and (player.index in owners)]
         try:
-            return choice(people)
+            return self.board.rng.choice(people)
         except IndexError:
             return
 
@@ -547,77 +1189,72 @@ class Player:
         if person:
             resources = flatten_counts(person.resources)
             if resources:
-                resource = choice(resources)
+                resource = self.board.rng.choice(resources)
                 person.resources[resource] -= 1
                 self.resources[resource] += 1
                 return True
         return False
 
-    def move_robber(self):  # stealing disabled for the sake of simplicity
-        tile = self.choose_tile_to_occupy()
-        robber_tile = self.board.robber
-        robber_tile.robber = False
-        if tile != robber_tile:
-            self.board.robber = tile
-            tile.robber = True
+    def move_robber(self, tile=None):  # to the given land tile, or the one the heuristic picks
+        if tile is None:
+            tile = self.choose_tile_to_occupy()
+        if tile != self.board.robber:
+            self.board.place_robber(tile)
             self.steal(tile)
             return True
         else:
             assert False, "Robber cannot be moved to the same tile!"
 
     def roll(self):
-        dice = [randint(1, 6), randint(1, 6)]
+        dice = [self.board.rng.randint(1, 6), self.board.rng.randint(1, 6)]
         if sum(dice) == 7:
             ttl = sum(self.resources.values())
             if ttl >= 8:
                 self.drop_resources(ttl // 2)
             self.move_robber()
-        for tile in self.board.tiles:
-            if tile.die == sum(dice) and tile.terrain_type not in ["water", "desert"] and not tile.robber:
-                for spot in tile.spots.values():
-                    if spot.owner == self.name:
-                        self.resources[tile.terrain_type] += spot.build_level
+        self.board.resources += self.board.production[sum(dice)]  # everyone collects, not just the roller
         return dice
 
-    def build_road(self):
-        path = self.choose_path_to_build()
+    def build_road(self, path=None):  # the build_* methods pick where to build with heuristics unless told
+        if path is None:
+            path = self.choose_path_to_build()
         if path is None:
             return False
         self.roads -= 1
-        path.build_level = 1
         if self.board.turn > 0:
             self.resources["brick"] -= 1
             self.resources["lumber"] -= 1
-        path.owner = self.name
+        self.board.place_road(self.index, path)
         return True
 
-    def build_settlement(self):
-        spot = self.choose_spot_to_build()
+    def build_settlement(self, spot=None):
+        if spot is None:
+            spot = self.choose_spot_to_build()
         if spot is None:
             return False
         self.settlements -= 1
-        spot.build_level = 1
+        self.board.place_building(self.index, spot)
         if self.board.turn <= 0:
             if self.board.turn == 0:
-                for tile in spot.tiles:
-                    if tile.terrain_type not in ["water", "desert"]:
-                        self.resources[tile.terrain_type] += 1
+                for t in TOPOLOGY.spot_tiles[spot]:
+                    if TERRAINS[self.board.terrain[t]] in RESOURCES:
+                        self.resources[TERRAINS[self.board.terrain[t]]] += 1
         else:
             self.resources["brick"] -= 1
             self.resources["lumber"] -= 1
             self.resources["sheep"] -= 1
             self.resources["wheat"] -= 1
         self.victory_points += 1
-        spot.owner = self.name
-        return spot
+        return True
 
-    def build_city(self):
-        spot = self.choose_spot_to_upgrade()
+    def build_city(self, spot=None):
+        if spot is None:
+            spot = self.choose_spot_to_upgrade()
         if spot is None:
             return False
         self.cities -= 1
         self.settlements += 1
-        spot.build_level = 2
+        self.board.place_building(self.index, spot)
         self.resources["wheat"] -= 2
         self.resources["ore"] -= 3
         self.victory_points += 1
@@ -627,7 +1264,7 @@ class Player:
     def buy_dev_card(self):
         resource_req = self.resources["wheat"] > 0 and self.resources["sheep"] > 0 and self.resources["ore"] > 0
         if resource_req and sum(self.board.dev_cards.values()) > 0:
-            card = choice([card for card in self.board.dev_cards if self.board.dev_cards[card]])
+            card = self.board.rng.choice([card for card in self.board.dev_cards if self.board.dev_cards[card]])
             self.resources["sheep"] -= 1
             self.resources["wheat"] -= 1
             self.resources["ore"] -= 1
@@ -638,15 +1275,16 @@ class Player:
             return True
         return False
 
-    def play_dev_card(self):
-        card = self.choose_dev_card()
+    def play_dev_card(self, card=None, target=None):  # target is a knight's tile or a monopoly's resource, if chosen
+        if card is None:
+            card = self.choose_dev_card()
         if card is not None:
             self.dev_cards[card] -= 1
             if card == "knight":
-                self.move_robber()
+                self.move_robber(target)
                 self.knights += 1
             elif card == "monopoly":
-                resource = self.choose_resource()
+                resource = self.choose_resource() if target is None else target
                 for player in self.board.players:
                     if player.name != self.name:
                         self.resources[resource] += player.resources[resource]
@@ -664,58 +1302,65 @@ class Player:
             return True
         return False
 
-    def consolidate(self):
-        if sum(self.resources.values()) > 7:
-            harbors = []
-            for path in self.board.paths.values():
-                my_harbor = False
-                for spot in [self.board.spots[name] for name in path.spots]:
-                    if spot.owner == self.name:
-                        my_harbor = True
-                if my_harbor:
-                    harbors.append(path.harbor)
-            for resource in self.resources:
-                if random() < 0.5:
-                    continue
-                if resource in harbors and self.resources[resource] > 1:
-                    self.resources[resource] -= 2
-                    self.resources[self.choose_resource(resource)] += 1
-                elif "3:1" in harbors and self.resources[resource] > 2:
-                    self.resources[resource] -= 3
-                    self.resources[self.choose_resource(resource)] += 1
-                elif self.resources[resource] > 3:
-                    self.resources[resource] -= 4
-                    self.resources[self.choose_resource(resource)] += 1
-
-    def longest_road_helper(self, path, length):
-        longest = length
-        for neighbor in path.neighbors.values():
-            name = set(neighbor.spots).difference(path.spots).pop()
-            if neighbor.owner == self.name and not neighbor.visited and (
-                    not self.board.spots[name].build_level or self.board.spots[name].owner == self.name):
-                neighbor.visited = True
-                longest = max(longest, self.longest_road_helper(neighbor, length + 1))
-                neighbor.visited = False
-        return longest
+    def consolidate(self):  # trade a big hand down with the bank, then offer the others a card we have most of
+        hand = self.board.resources[self.index]
+        if hand.sum() > 7:
+            rates = self.board.rates[self.index]
+            for give in argsort(rates - hand, kind="stable"):  # the most cards to spare over the rate first
+                if hand[give] >= rates[give]:
+                    self.board.trade_with_bank(self.index, give, RESOURCE_INDEX[self.choose_resource(RESOURCES[give])])
+        give = int(argmax(hand))
+        if hand[give] > 1:
+            self.board.offer(self.index, give, RESOURCE_INDEX[self.choose_resource(RESOURCES[give])])
 
     def longest_road(self):
-        longest = 0
-        for name, path in self.board.paths.items():
-            if path.owner == self.name:
-                path.visited = True
-                longest = max(longest, self.longest_road_helper(path, 1))
-                path.visited = False
-        return longest
+        return self.board.road_network.longest[self.index]
 
     def most_harbors(self):
-        return sum([sum(self.board.spots[spot].build_level for spot in path.spots) for path in self.board.paths.values()
-                    if (path.owner == self.name) and path.harbor and (path.harbor != "N/A")])
+        return int(self.board.encoder.harbors[self.index])
 
     def largest_army(self):
         return sum([self.knights for player in self.board.players if player.name == self.name])
 
     def move(self, distribution):
-        instruction = np_choice(len(distribution), p=0.05 / len(distribution) + 0.95 * distribution)
+        if not getattr(self.agent, "explore", True):  # agents that pick their action themselves get exactly it
+            if getattr(self.agent, "fine_actions", False):
+                self.take(int(argmax(distribution)))
+            else:
+                self.execute(int(argmax(distribution)))
+            return
+        if getattr(self.agent, "fine_actions", False):  # explore among the legal actions only
+            mask = self.board.mask
+            weights = 0.05 * mask / mask.sum() + 0.95 * mask * distribution
+            self.take(self.board.rng.choices(range(len(distribution)), weights)[0])
+            return
+        weights = 0.05 / len(distribution) + 0.95 * distribution
+        self.execute(self.board.rng.choices(range(len(distribution)), weights)[0])
+
+    def take(self, action):  # one of the fine-grained ACTIONS, which must be legal
+        if action in ROAD_ACTIONS:
+            self.build_road(action - ROAD_ACTIONS.start)
+        elif action in SETTLEMENT_ACTIONS:
+            self.build_settlement(action - SETTLEMENT_ACTIONS.start)
+        elif action in CITY_ACTIONS:
+            self.build_city(action - CITY_ACTIONS.start)
+        elif action == BUY_DEV_CARD_ACTION:
+            self.buy_dev_card()
+        elif action in KNIGHT_ACTIONS:
+            self.play_dev_card("knight", action - KNIGHT_ACTIONS.start)
+        elif action == ROAD_BUILDING_ACTION:
+            self.play_dev_card("road_building")
+        elif action == YEAR_OF_PLENTY_ACTION:
+            self.play_dev_card("year_of_plenty")
+        elif action in MONOPOLY_ACTIONS:
+            self.play_dev_card("monopoly", RESOURCES[action - MONOPOLY_ACTIONS.start])
+        elif action in TRADE_ACTIONS:
+            self.board.trade_with_bank(self.index, *TRADES[action - TRADE_ACTIONS.start])
+        elif action != PASS_ACTION:
+            raise ValueError("Invalid action: {}".format(action))
+        self.actions.append(action)
+
+    def execute(self, instruction):
         if instruction == 0:
             self.build_road()
         elif instruction == 1:
@@ -733,20 +1378,21 @@ class Player:
         self.actions.append(instruction)
 
     def get_self_state(self):
-        x = [self.knights, self.longest_road(), self.most_harbors(), self.largest_army()] + \
-            [self.resources[resource] for resource in self.resources] + \
-            [self.settlements, self.cities, self.roads] + \
-            [len(self.available_spots_for_settlement()), len(self.available_spots_for_city()),
-             len(self.available_paths())]
-        expected = [tile.probability * sum(spot.build_level for spot in tile.spots.values() if spot.owner == self.name)
-                    for tile in self.board.tiles]
-        for resource in ["brick", "lumber", "sheep", "wheat", "ore"]:
-            x.append(sum(expected[i] for i in range(19) if self.board.tiles[i].terrain_type == resource))
-        return x + [self.dev_cards[card] for card in self.dev_cards]
+        return self.board.encoder.self_states()[self.index].tolist()
 
     def get_state(self):
-        mean_state = mean([player.get_self_state() for player in self.board.players], axis=0).tolist()
-        return self.get_self_state() + mean_state[:-5] + [sum(mean_state[-5:])]
+        return self.board.encoder.state(self.index)
+
+    def get_observation(self):  # the state plus the board itself as this player sees it, for fine-grained agents
+        board = self.board
+        mine = board.spot_owner == self.index
+        theirs = (board.spot_owner != NOBODY) & ~mine
+        robber = zeros(TOPOLOGY.n_land)
+        robber[board.robber] = 1
+        roads = board.path_owner == self.index
+        rates = board.rates[self.index] / 4
+        return concatenate([self.get_state(), board.spot_level * mine, board.spot_level * theirs, roads,
+                            (board.path_owner != NOBODY) & ~roads, robber, board.spot_value, rates])
 
     def get_reward(self):
         improvement_time = self.victory_points - self.prev_victory_points > 0
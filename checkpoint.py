@@ -0,0 +1,111 @@
+import os
+import random
+import tempfile
+import threading
+
+import numpy as np
+import torch
+
+
+def rng_states():
+    """
+    :return: The states of the global random number generators training draws from: torch's, CUDA's, NumPy's and
+        Python's.
+    """
+    return {"torch": torch.get_rng_state(),
+            "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            "numpy": np.random.get_state(), "python": random.getstate()}
+
+
+def set_rng_states(states):
+    """
+    Puts the global random number generators back the way rng_states found them.
+
+    :param states: What rng_states returned.
+    """
+    torch.set_rng_state(states["torch"])
+    if states["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states["cuda"])
+    np.random.set_state(states["numpy"])
+    random.setstate(states["python"])
+
+
+def load(path):
+    """
+    :param path: A checkpoint written by a Checkpointer.
+    :return: What was saved in it, with every tensor on the CPU.
+    """
+    return torch.load(path, map_location="cpu", weights_only=False)  # it holds NumPy and Python RNG states
+
+
+class Checkpointer:
+    """
+    Writes checkpoints of a training run in a background thread, so training carries on while they are saved.
+
+    Every checkpoint is written to a temporary file next to the destination and then moved over it, so the file at
+    path is always a whole checkpoint, even if the run is killed partway through a write. Only the latest checkpoint
+    is kept. Whatever is saved mustn't change while it's being written: it should be a copy, or training should wait
+    for the write before changing it.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Where to keep the latest checkpoint.
+        """
+        self.path = path
+        self.thread = None
+        self.error = None
+
+    def save(self, state):
+        """
+        Starts writing a checkpoint, once the previous one has been written.
+
+        :param state: What to save, which torch.save must be able to write.
+        """
+        self.wait()
+        self.thread = threading.Thread(target=self.write, args=(state,))
+        self.thread.start()
+
+    def write(self, state):
+        """
+        Writes a checkpoint and moves it into place.
+
+        :param state: What to save.
+        """
+        temporary = None
+        try:
+            descriptor, temporary = tempfile.mkstemp(prefix=".checkpoint-", suffix=".tmp",
+                                                     dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(descriptor, "wb") as file:
+                torch.save(state, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(temporary, 0o644)  # mkstemp makes it private to its owner
+            os.replace(temporary, self.path)
+        except BaseException as error:  # reported by the next wait, as it can't be raised from this thread
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+            self.error = error
+
+    def wait(self):
+        """
+        Waits for the checkpoint being written, raising whatever went wrong writing it.
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        """
+        Waits for the last checkpoint to be written.
+        """
+        self.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,241 @@
+import numpy as np
+
+import catan
+
+
+class External:
+    """
+    Sits in the seats an environment's caller plays, whose actions come in through step rather than get_action.
+    """
+
+    def __init__(self, fine_actions=False):
+        """
+        :param fine_actions: Whether the caller picks among catan.ACTIONS rather than the 6 kinds of move.
+        """
+        self.fine_actions = fine_actions
+
+    def get_action(self, state, *args):
+        """
+        Refuses, as the caller decides for this seat.
+        """
+        raise RuntimeError("This seat is played through the environment's step.")
+
+
+class VectorCatanEnv:
+    """
+    Many games that are stepped together, with one action per game per step, in the style of a Gym vector
+    environment.
+
+    The caller plays every seat by default, so each step is one turn of whichever player is due in each game, and
+    the observations are of the player due next. With seat set, the caller plays only that seat and the others are
+    played by opponent in between.
+
+    A game that ends is reset straight away. Its last observation and result are then reported in the step's info,
+    and the observation returned is the first one of the new game.
+    """
+
+    def __init__(self, n_envs, seed=None, fine_actions=False, seat=None, opponent=None, max_turns=None,
+                 profiler=None):
+        """
+        Sets up the games; reset starts them.
+
+        :param n_envs: The number of games to play at once.
+        :param seed: The seed the games' seeds are drawn from, or None for fresh ones.
+        :param fine_actions: Whether actions are catan.ACTIONS, with the observations and masks those need, rather than
+            the 6 kinds of move.
+        :param seat: The one seat the caller plays, or None to play them all.
+        :param opponent: The agent, or list of agents by seat, that plays the other seats when seat is set.
+        :param max_turns: The turn at which a game is cut short and reported as truncated, or None for no limit.
+        :param profiler: A profiling.Profiler to time the games' phases with.
+        """
+        if (seat is None) != (opponent is None):
+            raise ValueError("A seat for the caller and an opponent for the other seats go together.")
+        self.n_envs = n_envs
+        self.fine_actions = fine_actions
+        self.seat = seat
+        self.opponent = opponent
+        self.max_turns = max_turns
+        self.profiler = profiler
+        self.observation_size = catan.OBSERVATION_SIZE if fine_actions else catan.STATE_SIZE
+        self.n_actions = catan.ACTIONS if fine_actions else catan.INSTRUCTIONS
+        self.rng = np.random.default_rng(seed)
+        self.seeded = seed is not None
+        self.external = External(fine_actions)
+        self.boards = [None] * n_envs
+        self.observations = np.zeros((n_envs, self.observation_size), dtype=np.float32)
+        self.masks = np.ones((n_envs, self.n_actions), dtype=bool)
+
+    def agents(self):
+        """
+        :return: The agent in every seat, with External in the ones the caller plays.
+        """
+        if self.seat is None:
+            return [self.external] * len(catan.PLAYER_NAMES)
+        agents = list(self.opponent) if isinstance(self.opponent, (list, tuple)) else \
+            [self.opponent] * len(catan.PLAYER_NAMES)
+        agents[self.seat] = self.external
+        return agents
+
+    def new_game(self, i, seed=None):
+        """
+        Starts a new game in one slot and plays up to the caller's first decision.
+
+        :param i: The slot.
+        :param seed: The game's seed, or None to draw one from the environment's stream.
+        """
+        if seed is None and self.seeded:
+            seed = int(self.rng.integers(1 << 63))
+        board = catan.Board(seed, self.profiler)
+        board.setup(self.agents())
+        self.boards[i] = board
+        self.advance(i)
+
+    def advance(self, i):
+        """
+        Plays the other seats of one game until it's the caller's turn or the game is over, and observes that turn.
+
+        :param i: The slot.
+        """
+        board = self.boards[i]
+        while not self.finished(board):
+            state = board.observe()
+            if board.players[board.current].agent is self.external:
+                self.observations[i] = state
+                if self.fine_actions:
+                    self.masks[i] = board.mask
+                return
+            board.act(board.decide(state))
+
+    def final_observation(self, player):
+        """
+        :param player: The player who made the last move of a game.
+        :return: What they would observe of the finished game.
+        """
+        return np.asarray(player.get_observation() if self.fine_actions else player.get_state(), dtype=np.float32)
+
+    def finished(self, board):
+        """
+        :param board: A game.
+        :return: Whether the game is over or has run out of turns.
+        """
+        return board.is_game_over or (self.max_turns is not None and board.turn >= self.max_turns)
+
+    def reset(self, seed=None):
+        """
+        Starts every game afresh.
+
+        :param seed: A new seed to play the games from, or None to carry on with the current one.
+        :return: The observation of the player due in each game, and an info dict with the legal actions in each
+            ("masks") and which seat is due ("players").
+        """
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+            self.seeded = True
+        for i in range(self.n_envs):
+            self.new_game(i)
+        return self.observations.copy(), self.info()
+
+    def info(self):
+        """
+        :return: The legal actions and the seat due in each game.
+        """
+        return {"masks": self.masks.copy(), "players": np.array([board.current for board in self.boards])}
+
+    def step(self, actions):
+        """
+        Takes one action in every game.
+
+        :param actions: The action for the player due in each game, from the environment's action space.
+        :return: The next observations; each acting player's reward for their action; whether each game ended, and
+            whether it was cut short by max_turns instead; and the info dict reset returns, plus for the games that
+            ended, their last observation ("final_observations"), winner or -1 ("winners") and final turn
+            ("final_turns").
+        """
+        rewards = np.zeros(self.n_envs, dtype=np.float32)
+        terminated = np.zeros(self.n_envs, dtype=bool)
+        truncated = np.zeros(self.n_envs, dtype=bool)
+        final_observations = np.zeros_like(self.observations)
+        winners = np.full(self.n_envs, catan.NOBODY)
+        final_turns = np.zeros(self.n_envs, dtype=int)
+        for i, (board, action) in enumerate(zip(self.boards, actions)):
+            player = board.players[board.current]
+            board.apply(int(action))
+            rewards[i] = player.get_reward()
+            self.advance(i)
+            if self.finished(board):
+                terminated[i] = board.is_game_over
+                truncated[i] = not board.is_game_over
+                final_observations[i] = self.final_observation(player)
+                winners[i] = catan.NOBODY if board.winner is None else board.winner.index
+                final_turns[i] = board.final_turn if board.is_game_over else board.turn
+                self.new_game(i)
+        info = self.info()
+        info.update(final_observations=final_observations, winners=winners, final_turns=final_turns)
+        return self.observations.copy(), rewards, terminated, truncated, info
+
+
+class CatanEnv:
+    """
+    One game with reset and step, in the style of a Gym environment. It's a VectorCatanEnv of one game, without the
+    batch dimension and without resetting itself.
+    """
+
+    def __init__(self, seed=None, fine_actions=False, seat=None, opponent=None, max_turns=None, profiler=None):
+        """
+        Sets up the game; reset starts it.
+
+        :param seed: The seed the games' seeds are drawn from, or None for fresh ones.
+        :param fine_actions: Whether actions are catan.ACTIONS rather than the 6 kinds of move.
+        :param seat: The one seat the caller plays, or None to play them all.
+        :param opponent: The agent, or list of agents by seat, that plays the other seats when seat is set.
+        :param max_turns: The turn at which the game is cut short and reported as truncated, or None for no limit.
+        :param profiler: A profiling.Profiler to time the game's phases with.
+        """
+        self.env = VectorCatanEnv(1, seed, fine_actions, seat, opponent, max_turns, profiler)
+        self.observation_size = self.env.observation_size
+        self.n_actions = self.env.n_actions
+
+    @property
+    def board(self):
+        """
+        :return: The game being played.
+        """
+        return self.env.boards[0]
+
+    def reset(self, seed=None):
+        """
+        Starts a new game.
+
+        :param seed: The seed to play it from, or None to draw one from the environment's stream.
+        :return: The observation of the player due, and an info dict with their legal actions ("mask") and seat
+            ("player").
+        """
+        self.env.new_game(0, seed)
+        return self.env.observations[0].copy(), self.info()
+
+    def info(self):
+        """
+        :return: The legal actions and seat of the player due.
+        """
+        return {"mask": self.env.masks[0].copy(), "player": self.board.current}
+
+    def step(self, action):
+        """
+        Takes an action for the player due.
+
+        :param action: The action, from the environment's action space.
+        :return: The next observation, the acting player's reward, whether the game is over, whether it was cut short
+            by max_turns instead, and the info dict reset returns plus the winner, or -1 ("winner").
+        """
+        board = self.board
+        player = board.players[board.current]
+        board.apply(int(action))
+        reward = player.get_reward()
+        self.env.advance(0)
+        terminated = board.is_game_over
+        truncated = not terminated and self.env.finished(board)
+        info = self.info()
+        info["winner"] = catan.NOBODY if board.winner is None else board.winner.index
+        if terminated or truncated:
+            return self.env.final_observation(player), reward, terminated, truncated, info
+        return self.env.observations[0].copy(), reward, terminated, truncated, info
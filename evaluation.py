@@ -0,0 +1,283 @@
+import argparse
+import multiprocessing
+
+import numpy as np
+import torch
+
+import catan
+from catan import RandomAgent  # lives in catan so that using it doesn't need torch
+from reinforcement import Network
+from rollout import PolicyAgent
+from runtime import Runtime
+
+
+class HeuristicAgent:
+    """
+    An agent that takes the most valuable action the player can afford and has room for, leaving where to build, what
+    to play and what to trade to the Player's own choose_* defaults.
+
+    It prefers a city, then a settlement, then a road when there is nowhere left to settle, then a dev card, then
+    playing one, then any road, and trades when it can do none of those. Its choice is played as it is, without the
+    exploration Player.move adds for learning agents.
+    """
+
+    sees_board = True
+    explore = False
+
+    def get_action(self, state, board):
+        """
+        :param state: The current state of the game.
+        :param board: The board the state came from.
+        :return: A distribution that puts all its weight on the chosen action.
+        """
+        player = board.players[board.current]
+        hand = player.resources
+        paths, settlements, cities = (mask.any() for mask in board.legal_moves(player.index))
+        can_road = hand["brick"] > 0 and hand["lumber"] > 0 and player.roads > 0 and paths
+        playable = any(count for card, count in player.dev_cards.items() if card != "victory_point")
+        if hand["ore"] > 2 and hand["wheat"] > 1 and player.cities > 0 and cities:
+            action = 2
+        elif all(hand[resource] > 0 for resource in ("brick", "lumber", "sheep", "wheat")) and \
+                player.settlements > 0 and settlements:
+            action = 1
+        elif can_road and not settlements:
+            action = 0
+        elif hand["wheat"] > 0 and hand["sheep"] > 0 and hand["ore"] > 0 and sum(board.dev_cards.values()) > 0:
+            action = 3
+        elif playable:
+            action = 4
+        elif can_road:
+            action = 0
+        else:
+            action = 5
+        distribution = np.zeros(catan.INSTRUCTIONS)
+        distribution[action] = 1
+        return distribution
+
+
+def load_checkpoint(path):
+    """
+    Loads a network saved by reinforcement.main as an agent that plays on the CPU.
+
+    :param path: The .pth file with the network's state dict.
+    :return: The agent, using fine-grained actions if the network has an output for each of them.
+    """
+    state_dict = torch.load(path, map_location="cpu")
+    network = Network(state_dict["fc1.weight"].shape[1], state_dict["fc3.weight"].shape[0])
+    network.load_state_dict(state_dict)
+    return PolicyAgent(network.eval(), network.fc3.out_features == catan.ACTIONS)
+
+
+def cpu_agent(agent):
+    """
+    :param agent: An agent, such as a ReinforcementAgent whose network may be on another device.
+    :return: An agent that can be sent to another process: a CPU copy of the agent's network, or the agent itself if
+        it has none.
+    """
+    if not hasattr(agent, "network"):
+        return agent
+    network = Network(agent.network.fc1.in_features, agent.network.fc3.out_features)
+    network.load_state_dict({name: tensor.detach().cpu() for name, tensor in agent.network.state_dict().items()})
+    return PolicyAgent(network.eval(), getattr(agent, "fine_actions", False))
+
+
+def wilson_interval(wins, games, z=1.96):
+    """
+    :param wins: The number of games won.
+    :param games: The number of games played.
+    :param z: The normal quantile of the interval's confidence, 1.96 for 95%.
+    :return: The Wilson score interval around the win rate.
+    """
+    if not games:
+        return 0.0, 1.0
+    rate = wins / games
+    centre = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    spread = z / (1 + z * z / games) * (rate * (1 - rate) / games + z * z / (4 * games * games)) ** 0.5
+    return max(0.0, centre - spread), min(1.0, centre + spread)
+
+
+def play_rotations(candidate, opponent, seed, record, max_turns):
+    """
+    Plays the candidate against three copies of an opponent on one board, once from every seat.
+
+    Each of the games is played from the same seed, so the candidate sees the same board, dice and draws from every
+    seat, and the only difference between them is where it sits.
+
+    :param candidate: The agent being evaluated.
+    :param opponent: The agent it plays against.
+    :param seed: The seed of the games.
+    :param record: The board's catan.BOARD_RECORD, or None to lay it out from the seed. A record saved mid-game is
+        played on from where it was saved.
+    :param max_turns: The turn after which an unfinished game counts as a loss.
+    :return: For each seat, whether the candidate won, the turn the game ended on and the candidate's victory points.
+    """
+    results = []
+    for seat in range(len(catan.PLAYER_NAMES)):
+        agents = [opponent] * len(catan.PLAYER_NAMES)
+        agents[seat] = candidate
+        board = catan.Board(seed) if record is None else catan.Board.from_record(record, agents, seed)
+        if not board.players:
+            board.setup(agents)
+        while not board.is_game_over and board.turn < max_turns:
+            board.act(board.decide(board.observe()))
+        results.append((board.winner is not None and board.winner.index == seat,
+                        board.final_turn if board.is_game_over else board.turn, board.players[seat].victory_points))
+    return results
+
+
+def initialize_worker():
+    Runtime(threads=1).configure()  # the evaluator's parallelism comes from its processes
+
+
+class Evaluator:
+    """
+    Plays an agent against fixed baselines over a fixed set of boards, in worker processes.
+
+    The boards are either laid out from seeds derived from one seed, or read from a file written by catan.save_boards,
+    so every evaluation, of every checkpoint, faces the same games. The candidate plays each board from every seat
+    against three copies of each opponent, and its win rate against each comes with a Wilson confidence interval.
+    Winning a quarter of the games is parity.
+
+    Evaluations can be submitted without waiting for them, so training carries on while the workers play.
+    """
+
+    def __init__(self, opponents=None, boards=25, seed=0, workers=None, max_turns=500):
+        """
+        Starts the worker processes.
+
+        :param opponents: The agents to play against by name, random and heuristic play by default.
+        :param boards: The number of boards to lay out from the seed, or the path of a file of board records.
+        :param seed: The seed of the boards and of the games played on them.
+        :param workers: The number of worker processes, one per CPU by default, or 0 to play in this process.
+        :param max_turns: The turn after which an unfinished game counts as a loss.
+        """
+        self.opponents = opponents or {"random": RandomAgent(), "heuristic": HeuristicAgent()}
+        if isinstance(boards, int):
+            self.records = [None] * boards
+        else:
+            self.records = list(catan.load_records(boards, mmap=False))
+        self.seeds = catan.game_seeds(seed, len(self.records))
+        self.max_turns = max_turns
+        self.pool = None
+        if workers != 0:
+            self.pool = multiprocessing.get_context("spawn").Pool(workers, initializer=initialize_worker)
+        self.pending = []
+        self.finished = []  # evaluations that finished while evaluate waited, for the next collect
+
+    def jobs(self, candidate):
+        """
+        :param candidate: The agent being evaluated.
+        :return: The arguments of play_rotations for every opponent and board, and the opponent each is for.
+        """
+        candidate = cpu_agent(candidate)
+        return [((candidate, opponent, seed, record, self.max_turns), name)
+                for name, opponent in self.opponents.items() for seed, record in zip(self.seeds, self.records)]
+
+    def submit(self, candidate, label=None):
+        """
+        Starts evaluating an agent in the background.
+
+        :param candidate: The agent to evaluate. Agents with a network are evaluated on a CPU copy of it, taken now.
+        :param label: What to call the evaluation, such as the epoch it was submitted at.
+        """
+        jobs = self.jobs(candidate)
+        if self.pool is None:
+            results = [play_rotations(*args) for args, _ in jobs]
+        else:
+            results = self.pool.starmap_async(play_rotations, [args for args, _ in jobs])
+        self.pending.append((label, [name for _, name in jobs], results))
+
+    def collect(self, wait=False):
+        """
+        Gets the evaluations that have finished, in the order they were submitted.
+
+        :param wait: Whether to wait for every submitted evaluation to finish.
+        :return: The label and report of each finished evaluation.
+        """
+        finished, self.finished = self.finished, []
+        while self.pending:
+            label, names, results = self.pending[0]
+            if not isinstance(results, list):
+                if not wait and not results.ready():
+                    break
+                results = results.get()
+            finished.append((label, self.report(names, results)))
+            self.pending.pop(0)
+        return finished
+
+    def evaluate(self, candidate):
+        """
+        Evaluates an agent and waits for the result. Evaluations submitted earlier are waited for too, and kept for
+        the next collect.
+
+        :param candidate: The agent to evaluate.
+        :return: The report of the evaluation.
+        """
+        self.submit(candidate)
+        finished = self.collect(wait=True)
+        self.finished = finished[:-1]
+        return finished[-1][1]
+
+    def report(self, names, results):
+        """
+        :param names: The opponent each set of games was against.
+        :param results: What play_rotations returned for each set.
+        :return: For each opponent, the games played, games won, win rate, its confidence interval, mean final turn and
+            the candidate's mean victory points.
+        """
+        report = {}
+        for name in self.opponents:
+            games = [game for opponent, rotations in zip(names, results) if opponent == name for game in rotations]
+            wins = sum(won for won, _, _ in games)
+            report[name] = {"games": len(games), "wins": wins, "win_rate": wins / len(games),
+                            "interval": wilson_interval(wins, len(games)),
+                            "turns": float(np.mean([turn for _, turn, _ in games])),
+                            "victory_points": float(np.mean([points for _, _, points in games]))}
+        return report
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def format_report(report):
+    """
+    :param report: What Evaluator.evaluate returned.
+    :return: The report as one line per opponent.
+    """
+    return "\n".join(f"vs {name}: {result['wins']}/{result['games']} won, {result['win_rate']:.1%} "
+                     f"[{result['interval'][0]:.1%}, {result['interval'][1]:.1%}], {result['turns']:.0f} turns, "
+                     f"{result['victory_points']:.1f} victory points" for name, result in report.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plays a checkpoint against baseline agents on fixed boards.")
+    parser.add_argument("checkpoint", help="the .pth file saved by reinforcement.main")
+    parser.add_argument("--opponents", nargs="+", default=["random", "heuristic"],
+                        help="random, heuristic or the .pth files of older checkpoints")
+    parser.add_argument("--boards", default="25", help="a number of boards to lay out, or a file of board records")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the boards and games")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, one per CPU by default")
+    arguments = parser.parse_args()
+
+    baselines = {"random": RandomAgent, "heuristic": HeuristicAgent}
+    opponents = {name: baselines[name]() if name in baselines else load_checkpoint(name)
+                 for name in arguments.opponents}
+    boards = int(arguments.boards) if arguments.boards.isdigit() else arguments.boards
+    with Evaluator(opponents, boards, arguments.seed, arguments.workers) as evaluator:
+        print(format_report(evaluator.evaluate(load_checkpoint(arguments.checkpoint))))
+
+
+if __name__ == '__main__':
+    main()
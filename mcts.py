@@ -0,0 +1,145 @@
+import multiprocessing
+import time
+
+import numpy as np
+
+import catan
+
+
+def playout(board, player, depth):
+    """
+    Plays random actions for every seat from the board's current turn onward.
+
+    :param board: The board to play on, which is changed.
+    :param player: The seat whose result is wanted.
+    :param depth: The most turns to play before judging the position.
+    :return: 1 if the seat won, 0 if another did, otherwise the seat's share of the victory points of it and its
+        strongest opponent.
+    """
+    for _ in range(depth):
+        if board.is_game_over:
+            break
+        board.begin_turn()
+        board.players[board.current].execute(board.rng.randrange(catan.INSTRUCTIONS))
+        board.end_turn()
+    if board.is_game_over:
+        return float(board.winner.index == player)
+    points = board.players[player].victory_points
+    best = max(other.victory_points for other in board.players if other.index != player)
+    return points / (points + best) if points + best else 0.5
+
+
+def search(board, rollouts, time_limit, depth, exploration, prior):
+    """
+    Runs Monte Carlo tree search from the start of the current player's decision.
+
+    The tree is a single layer of the player's actions, chosen by PUCT and scored by random playouts. The dice make
+    deeper layers rarely worth revisiting.
+
+    :param board: The board, whose current player has rolled and is about to act. It is left as it was.
+    :param rollouts: The most playouts to run.
+    :param time_limit: The most seconds to search for, or None for no limit.
+    :param depth: The most turns each playout runs for.
+    :param exploration: How strongly to favour actions that have been tried less.
+    :param prior: The prior probability of each action.
+    :return: The number of playouts and the total value for each action.
+    """
+    player = board.current
+    visits = np.zeros(catan.INSTRUCTIONS)
+    values = np.zeros(catan.INSTRUCTIONS)
+    deadline = time_limit and time.perf_counter() + time_limit
+    snapshot = board.snapshot()
+    for rollout in range(rollouts):
+        if deadline and time.perf_counter() > deadline:
+            break
+        means = np.divide(values, visits, out=np.full(catan.INSTRUCTIONS, 0.5), where=visits > 0)
+        action = int(np.argmax(means + exploration * prior * np.sqrt(rollout + 1) / (1 + visits)))
+        board.players[player].execute(action)
+        board.end_turn()
+        visits[action] += 1
+        values[action] += playout(board, player, depth)
+        board.restore(snapshot)
+    return visits, values
+
+
+def search_worker(board, seed, *args):
+    """
+    Runs a search in a worker process, on its own random stream.
+
+    :param board: The board to search from.
+    :param seed: The seed for the worker's playouts.
+    :param args: The rest of search's arguments.
+    :return: What search returns.
+    """
+    board.rng.seed(seed)
+    return search(board, *args)
+
+
+class MCTSAgent:
+    """
+    An agent that picks actions with Monte Carlo tree search over random playouts of the actual board.
+
+    The agent can be seated with Board.setup like any other. It sees the board through get_action's second
+    argument. Each decision gets a budget of playouts, a time limit or both. The playouts can be split across worker
+    processes, and another agent, such as a trained ReinforcementAgent, can supply the prior over actions. Its choice
+    is played as it is, without the exploration Player.move adds for learning agents.
+    """
+
+    sees_board = True
+    explore = False
+
+    def __init__(self, rollouts=32, time_limit=None, depth=16, exploration=1.0, prior=None, workers=0):
+        """
+        Configures the search.
+
+        :param rollouts: The most playouts per decision.
+        :param time_limit: The most seconds per decision, or None for no limit.
+        :param depth: The most turns each playout runs for.
+        :param exploration: How strongly to favour actions that have been tried less.
+        :param prior: An agent whose get_action gives the prior over actions, or None for a uniform prior.
+        :param workers: The number of processes to split the playouts across, or 0 to run them in this one.
+        """
+        self.rollouts = rollouts
+        self.time_limit = time_limit
+        self.depth = depth
+        self.exploration = exploration
+        self.prior = prior
+        self.workers = workers
+        self.pool = None
+
+    def get_action(self, state, board):
+        """
+        Gets the action the agent should take given the current state.
+
+        :param state: The current state of the game.
+        :param board: The board the state came from.
+        :return: A distribution that puts all its weight on the action the search liked best.
+        """
+        if self.prior is None:
+            prior = np.full(catan.INSTRUCTIONS, 1 / catan.INSTRUCTIONS)
+        else:
+            prior = np.asarray(self.prior.get_action(state), dtype=np.float64)
+        args = (self.time_limit, self.depth, self.exploration, prior)
+        if self.workers:
+            if self.pool is None:
+                self.pool = multiprocessing.get_context("spawn").Pool(self.workers)
+            copy = board.clone()
+            for player in copy.players:
+                player.agent = None  # agents don't travel between processes, and playouts don't use them
+            share = -(-self.rollouts // self.workers)
+            jobs = [(copy, board.rng.getrandbits(64), share) + args for _ in range(self.workers)]
+            visits, values = np.sum(self.pool.starmap(search_worker, jobs), axis=0)
+        else:
+            visits, values = search(board, self.rollouts, *args)
+        distribution = np.zeros(catan.INSTRUCTIONS)
+        distribution[np.argmax(visits + values / (1 + visits))] = 1  # most visited, ties broken by value
+        return distribution
+
+    def close(self):
+        """
+        Stops the worker processes, if any were started.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
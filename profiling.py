@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+class Phase:
+    """
+    Times one run of a phase, as a context manager.
+    """
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        """
+        :param profiler: The profiler to record the time in.
+        :param name: The phase's name.
+        """
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+
+
+class Profiler:
+    """
+    Records the wall time and number of calls of the phases of a game's turns.
+
+    Boards, GameBatch and catan.simulate take a profiler and time the roll, state encoding, agent inference, action
+    execution and the longest road, largest army and most harbors updates with it. Without one they use
+    catan.NullProfiler, which does nothing, so the hooks can be left in place everywhere.
+
+    The totals come out as a table from summary. With trace set, every call is also kept so that save_trace can write
+    them in the Chrome trace event format, which chrome://tracing and Perfetto can open.
+    """
+
+    def __init__(self, trace=False):
+        """
+        Starts with nothing recorded.
+
+        :param trace: Whether to keep every call for save_trace, rather than only the totals.
+        """
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.events = [] if trace else None
+        self.origin = time.perf_counter()
+
+    def phase(self, name):
+        """
+        :param name: The phase's name.
+        :return: A context manager that times the code it wraps as one call of the phase.
+        """
+        return Phase(self, name)
+
+    def record(self, name, start, end):
+        """
+        Adds one call of a phase.
+
+        :param name: The phase's name.
+        :param start: When the call started, from time.perf_counter.
+        :param end: When the call ended, from time.perf_counter.
+        """
+        self.totals[name] += end - start
+        self.counts[name] += 1
+        if self.events is not None:
+            self.events.append((name, start, end, threading.get_ident()))
+
+    def reset(self):
+        """
+        Forgets everything recorded so far.
+        """
+        self.totals.clear()
+        self.counts.clear()
+        if self.events is not None:
+            self.events.clear()
+        self.origin = time.perf_counter()
+
+    def summary(self):
+        """
+        :return: A table of every phase's calls, total time, mean time and share of the time spent in all phases,
+            slowest phase first.
+        """
+        spent = sum(self.totals.values()) or 1
+        lines = [f"{'phase':<16}{'calls':>10}{'total s':>12}{'mean us':>12}{'share':>8}"]
+        for name in sorted(self.totals, key=self.totals.get, reverse=True):
+            total, count = self.totals[name], self.counts[name]
+            lines.append(f"{name:<16}{count:>10}{total:>12.3f}{1e6 * total / count:>12.2f}{total / spent:>8.1%}")
+        return "\n".join(lines)
+
+    def save_trace(self, path):
+        """
+        Writes every recorded call as a Chrome trace.
+
+        :param path: Where to write the trace's JSON.
+        """
+        if self.events is None:
+            raise ValueError("The profiler wasn't made with trace=True, so it has no calls to save.")
+        events = [{"name": name, "ph": "X", "ts": 1e6 * (start - self.origin), "dur": 1e6 * (end - start),
+                   "pid": os.getpid(), "tid": thread} for name, start, end, thread in self.events]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
@@ -1,16 +1,18 @@
-import matplotlib.pyplot as plot
+import argparse
+import copy
+from typing import Optional
+
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 
 import catan
-
-
-device = "mps" if torch.backends.mps.is_available() else "cpu"
-print(f"Using {device}.")
-
-torch.random.manual_seed(0)
+import checkpoint
+from profiling import Profiler
+from replay import ReplayBuffer
+from runtime import Runtime, default_device
 
 
 class Network(nn.Module):
@@ -32,16 +34,21 @@ class Network(nn.Module):
         self.fc2 = nn.Linear(128, 128)
         self.fc3 = nn.Linear(128, output_size)
 
-    def forward(self, x):
+    def forward(self, x, mask: Optional[torch.Tensor] = None):  # annotated for TorchScript
         """
         Performs a forward pass through the neural network.
 
-        :param x: The input to the neural network.
+        :param x: The input to the neural network, either one state or a batch of them.
+        :param mask: Which actions are legal, shaped like the output, or None if they all are. Illegal actions get no
+            probability.
         :return: The output of the neural network.
         """
         x = F.relu(self.fc1(x))
         x = F.relu(self.fc2(x))
-        x = nn.Softmax(dim=0)(self.fc3(x))
+        x = self.fc3(x)
+        if mask is not None:
+            x = x.masked_fill(~mask, float("-inf"))
+        x = F.softmax(x, dim=-1)
 
         return x
 
@@ -58,11 +65,31 @@ class ReinforcementAgent:
     for dying. The agent then uses the reward and penalty to update the weights of the neural network.
     """
 
-    def __init__(self):
+    def __init__(self, fine_actions=False, runtime=None, rollout_runtime=None):
         """
         Initializes the agent with a neural network.
+
+        :param fine_actions: Whether to choose among catan.ACTIONS, every concrete move with the illegal ones masked
+            out, from the player's observation, rather than among the 6 kinds of move from their state.
+        :param runtime: Where and how the network trains, on the default device by default.
+        :param rollout_runtime: Where and how the agent takes actions, on the CPU by default. Unless it's on the same
+            device as training, the agent acts with a copy of the network that follows its training.
         """
-        self.network = Network(46, 6).to(device)
+        self.fine_actions = fine_actions
+        self.runtime = runtime or Runtime(default_device())
+        self.rollout_runtime = rollout_runtime or Runtime()
+        self.device = self.runtime.device
+        if fine_actions:
+            self.network = Network(catan.OBSERVATION_SIZE, catan.ACTIONS).to(self.device)
+        else:
+            self.network = Network(catan.STATE_SIZE, catan.INSTRUCTIONS).to(self.device)
+        if torch.device(self.rollout_runtime.device).type == torch.device(self.device).type:
+            self.policy_network = self.network
+        else:
+            self.policy_network = Network(self.network.fc1.in_features, self.network.fc3.out_features)
+            self.policy_network.to(self.rollout_runtime.device).requires_grad_(False)
+        self.policy = None  # compiled from policy_network the first time an action is taken
+        self.policy_current = False
         self.optimizer = optim.NAdam(self.network.parameters(), lr=1e-4)
         self.loss_function = nn.CrossEntropyLoss(label_smoothing=0.1)
         self.losses = []
@@ -73,44 +100,107 @@ class ReinforcementAgent:
 
         self.final_turns = []
 
-    def get_action(self, state):
+    def get_action(self, state, mask=None):
         """
         Gets the action the agent should take given the current state.
 
         :param state: The current state of the game.
+        :param mask: The legal actions, when using fine-grained actions.
         :return: The action the agent should take.
         """
-        return self.network(torch.flatten(torch.tensor(state).to(torch.float32).to(device))).detach().cpu().numpy()
+        return self.get_actions(np.asarray(state)[None], None if mask is None else np.asarray(mask)[None])[0]
+
+    def get_actions(self, states, masks=None):
+        """
+        Gets the actions the agent should take in many games at once, with a single forward pass.
 
-    def train(self, states, actions, rewards, final_turn):
+        :param states: The current states of the games, one per row.
+        :param masks: The legal actions in each game, one per row, when using fine-grained actions.
+        :return: The actions the agent should take, one per row.
+        """
+        if not self.policy_current:
+            if self.policy_network is not self.network:
+                self.policy_network.load_state_dict(self.network.state_dict())
+            self.policy_current = True
+        if self.policy is None:
+            self.policy = self.rollout_runtime.prepare(self.policy_network)
+        device = self.rollout_runtime.device
+        with self.rollout_runtime.inference():
+            states = torch.from_numpy(np.asarray(states, dtype=np.float32)).to(device)
+            if masks is not None:
+                masks = torch.from_numpy(np.asarray(masks, dtype=bool)).to(device)
+            return self.policy(states, masks).cpu().numpy()
+
+    def train(self, states, actions, rewards, final_turn, epochs=1, batch_size=None, masks=None):
         """
         Trains the agent using the Q-learning algorithm.
 
+        Every step runs the network, the loss and the backward pass once over a whole batch of samples.
+
         :param states: The states the agent was in when it took the actions.
         :param actions: The actions the agent took.
         :param rewards: The rewards the agent received for taking the actions.
         :param final_turn: The turn the game ended on.
+        :param epochs: The number of passes to make over the samples.
+        :param batch_size: The number of samples per step, or None to take one step over all of them.
+        :param masks: The legal actions at each sample, when using fine-grained actions.
         """
-        states = torch.stack([torch.tensor(state).to(torch.float32).to(device) for state in states])
-        actions = torch.stack([torch.tensor(action).to(torch.long).to(device) for action in actions])
-        rewards = torch.stack([torch.tensor(reward).to(torch.float32).to(device) for reward in rewards])
-        self.optimizer.zero_grad()
-        loss = 0
-        for state, action, reward in zip(states, actions, rewards):
-            output = self.network(state)
-            target = output.clone()
-            target[action] = reward
-            loss += self.loss_function(output, target)
-        loss.backward()
-        self.optimizer.step()
-        self.losses.append(loss.item())
+        device = self.device
+        states = torch.from_numpy(np.asarray(states, dtype=np.float32)).to(device)
+        if masks is not None:
+            masks = torch.from_numpy(np.asarray(masks, dtype=bool)).to(device)
+        actions = torch.from_numpy(np.asarray(actions, dtype=np.int64)).to(device)
+        rewards = torch.from_numpy(np.asarray(rewards, dtype=np.float32)).to(device)
+        batch_size = batch_size or len(states)
+        losses = []
+        for _ in range(epochs):
+            order = torch.randperm(len(states), device=device) if batch_size < len(states) else None
+            for start in range(0, len(states), batch_size):
+                batch = slice(start, start + batch_size) if order is None else order[start:start + batch_size]
+                self.optimizer.zero_grad()
+                output = self.network(states[batch], None if masks is None else masks[batch])
+                target = output.clone()
+                target[torch.arange(len(output), device=device), actions[batch]] = rewards[batch]
+                # summed rather than averaged over the batch, as the loss has always been
+                loss = self.loss_function(output, target) * len(output)
+                loss.backward()
+                self.optimizer.step()
+                losses.append(loss.item())
+        self.policy_current = False
+        self.losses.append(sum(losses) / len(losses))
         self.rewards.append(rewards.mean().item())
         self.final_turns.append(final_turn)
 
+    def state_dict(self):
+        """
+        :return: Copies of everything the agent has learned and recorded, on the CPU, for load_state_dict.
+        """
+        return {"fine_actions": self.fine_actions,
+                "network": {name: tensor.detach().cpu().clone() for name, tensor in self.network.state_dict().items()},
+                "optimizer": copy.deepcopy(self.optimizer.state_dict()), "losses": list(self.losses),
+                "rewards": list(self.rewards), "final_turns": list(self.final_turns)}
+
+    def load_state_dict(self, state):
+        """
+        Takes up where an agent saved with state_dict left off.
+
+        :param state: What state_dict returned.
+        """
+        if state["fine_actions"] != self.fine_actions:
+            raise ValueError("The saved agent doesn't use the same actions as this one.")
+        self.network.load_state_dict(state["network"])
+        self.optimizer.load_state_dict(state["optimizer"])  # moves the moments to the network's device
+        self.losses = list(state["losses"])
+        self.rewards = list(state["rewards"])
+        self.final_turns = list(state["final_turns"])
+        self.policy_current = False
+
     def plot(self):
         """
         Plots the agent's losses and rewards.
         """
+        import matplotlib.pyplot as plot  # only needed when something is drawn
+
         plot.figure()
         plot.subplot(3, 1, 1)
         plot.plot(self.losses)
@@ -125,31 +215,160 @@ class ReinforcementAgent:
         plot.show()
 
 
-def main():
+def main(epochs=1000, games_per_epoch=5, plot=False, workers=0, replay_samples=0, seed=None, profile=False,
+         eval_every=0, eval_boards=25, asynchronous=False, max_staleness=2, fine_actions=False, device=None,
+         threads=None, rollout_threads=1, compiler=None, checkpoint_every=0, checkpoint_path="checkpoint.pt",
+         resume=None, eval_workers=1):
     """
     Trains the agent to play the game.
+
+    :param epochs: The number of training steps to take.
+    :param games_per_epoch: The number of games played for each training step, or the most when asynchronous.
+    :param plot: Whether to plot the agent's history once training is done.
+    :param workers: The number of processes to play games in, or 0 to play them in this process.
+    :param replay_samples: The number of transitions from earlier games to train on alongside each epoch's new ones.
+    :param seed: The seed the games are played from, or None for fresh ones every run.
+    :param profile: Whether to time the phases of the games played in this process and of training, and print them
+        once training is done.
+    :param eval_every: The number of epochs between evaluations against baseline agents, or 0 for none. They run in
+        the background and are printed as they finish.
+    :param eval_boards: The number of fixed boards each evaluation plays on.
+    :param asynchronous: Whether the workers keep playing while the agent trains, rather than taking turns with it.
+        Each training step then takes whichever games have finished, waiting only if none have.
+    :param max_staleness: When asynchronous, how many training steps behind the latest weights a game's may be before
+        it is thrown away, or None to keep every game.
+    :param fine_actions: Whether the agent picks concrete moves from catan.ACTIONS rather than the 6 kinds of move.
+    :param device: The device to train on, the fastest one available by default. Games are always played on the CPU.
+    :param threads: The number of threads torch may use in this process, or None for torch's default.
+    :param rollout_threads: The number of threads torch may use in each worker process.
+    :param compiler: How the network is compiled to play games with: None, "script" or "compile".
+    :param checkpoint_every: The number of epochs between checkpoints of the whole run, or 0 for none. They are
+        written in the background, and once more when training ends.
+    :param checkpoint_path: Where to keep the latest checkpoint.
+    :param resume: A checkpoint to carry on training from, at the epoch after it was saved, or None to start afresh.
+        The other arguments should be the ones the run was started with.
+    :param eval_workers: The number of processes evaluations play in, alongside training and any rollout workers, or 0
+        to play them in this process.
     """
-    agent = ReinforcementAgent()
+    if fine_actions and replay_samples:
+        raise ValueError("The replay buffer doesn't keep action masks, so it can't be used with fine_actions.")
+    runtime = Runtime(device or default_device(), threads)
+    runtime.configure()
+    rollout_runtime = Runtime("cpu", rollout_threads, compiler=compiler)
+    torch.manual_seed(0 if seed is None else seed)
+    agent = ReinforcementAgent(fine_actions, runtime, rollout_runtime)
+    print(f"Training on {runtime.device}.")
+    profiler = Profiler() if profile else catan.NULL_PROFILER
+    buffer = ReplayBuffer(seed=seed) if replay_samples else None
+    start = 0
+    pool_seeds = None
+    if resume:
+        saved = checkpoint.load(resume)
+        agent.load_state_dict(saved["agent"])
+        if buffer is not None and saved["buffer"] is not None:
+            buffer.load_state_dict(saved["buffer"])
+        checkpoint.set_rng_states(saved["rng"])
+        start, pool_seeds = saved["epoch"], saved["pool_seeds"]
+        print(f"Resuming from epoch {start}.")
+    pool = None
+    if workers:
+        from rollout import RolloutPool  # rollout imports this module
+
+        pool = RolloutPool(workers, seed, agent.network.fc1.in_features, agent.network.fc3.out_features,
+                           rollout_runtime)
+        if pool_seeds:
+            pool.restore_seeds(pool_seeds)
+    evaluator = None
+    if eval_every:
+        from evaluation import Evaluator, format_report  # evaluation imports this module
+
+        evaluator = Evaluator(boards=eval_boards, seed=0 if seed is None else seed, workers=eval_workers)
+    checkpointer = checkpoint.Checkpointer(checkpoint_path) if checkpoint_every else None
+
+    def save_checkpoint(epoch):
+        # games in flight in the pool are lost, and are played first on resuming, from their seeds
+        checkpointer.save({"epoch": epoch, "agent": agent.state_dict(),
+                           "buffer": buffer.state_dict() if buffer is not None else None,
+                           "pool_seeds": pool.seeds() if pool else None, "rng": checkpoint.rng_states()})
 
     # Train the agent.
-    for epoch in range(1000):
-        ARGS = [[], [], []]
-        final_turns = []
-        for _ in range(5):
-            game = catan.Board()
-            game.setup(agent)
-            states, actions, rewards = game.play()
-            ARGS[0].extend(states)
-            ARGS[1].extend(actions)
-            ARGS[2].extend(rewards)
-            final_turns.append(game.final_turn)
-        agent.train(*ARGS, sum(final_turns) / 5)
+    try:
+        for epoch in range(start, epochs):
+            if pool:
+                pool.update_weights(agent.network)
+                with profiler.phase("wait"):
+                    if asynchronous:
+                        pool.fill(2 * workers)  # enough that a worker always has its next game waiting
+                        trajectories = pool.fresh(games_per_epoch, max_staleness)
+                    else:
+                        trajectories = pool.collect(games_per_epoch)
+            else:
+                epoch_seed = None if seed is None else (seed, epoch)
+                trajectories = catan.simulate(games_per_epoch, agent, epoch_seed, batch=True, profiler=profiler)
+            masks = np.concatenate([trajectory.masks for trajectory in trajectories]) if fine_actions else None
+            samples = [(trajectory.states, trajectory.actions, trajectory.rewards) for trajectory in trajectories]
+            if buffer is not None:
+                if len(buffer):
+                    samples.append(buffer.sample(replay_samples)[:3])
+                if checkpointer:
+                    checkpointer.wait()  # the last checkpoint may still be writing out the buffer
+                for trajectory in trajectories:
+                    buffer.add_trajectory(trajectory)
+            states, actions, rewards = (np.concatenate(arrays) for arrays in zip(*samples))
+            final_turn = sum(trajectory.final_turn for trajectory in trajectories) / len(trajectories)
+            with profiler.phase("train"):
+                agent.train(states, actions, rewards, final_turn, masks=masks)
+            print(f"Epoch: {epoch}")
+            if evaluator:
+                if (epoch + 1) % eval_every == 0:
+                    evaluator.submit(agent, epoch)
+                for label, report in evaluator.collect(wait=epoch == epochs - 1):
+                    print(f"Evaluation at epoch {label}:\n{format_report(report)}")
+            if checkpointer and ((epoch + 1) % checkpoint_every == 0 or epoch == epochs - 1):
+                save_checkpoint(epoch + 1)
+    finally:
+        if checkpointer:
+            checkpointer.close()
+        if pool:
+            pool.close()
+        if evaluator:
+            evaluator.close()
+        if buffer is not None:
+            buffer.close()
+    if profile:
+        print(profiler.summary())
+    if plot:
         agent.plot()
-        print(f"Epoch: {epoch}")
 
     # Save the agent's neural network.
     torch.save(agent.network.state_dict(), 'reinforcement.pth')
 
 
+def parse_arguments():
+    """
+    :return: The arguments of main, from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Trains the agent by self-play.")
+    parser.add_argument("--epochs", type=int, default=1000, help="the number of training steps to take")
+    parser.add_argument("--games-per-epoch", type=int, default=5, help="the games played for each training step")
+    parser.add_argument("--workers", type=int, default=0, help="processes to play games in, 0 for this one")
+    parser.add_argument("--asynchronous", action="store_true", help="keep the workers playing while training")
+    parser.add_argument("--replay-samples", type=int, default=0, help="earlier transitions to train on per epoch")
+    parser.add_argument("--seed", type=int, default=None, help="the seed the games are played from")
+    parser.add_argument("--fine-actions", action="store_true", help="pick concrete moves rather than kinds of move")
+    parser.add_argument("--eval-every", type=int, default=0, help="epochs between evaluations, 0 for none")
+    parser.add_argument("--eval-workers", type=int, default=1, help="processes to play evaluations in")
+    parser.add_argument("--device", default=None, help="the device to train on, the fastest one by default")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads in this process")
+    parser.add_argument("--compiler", choices=("script", "compile"), default=None,
+                        help="how to compile the network games are played with")
+    parser.add_argument("--checkpoint-every", type=int, default=0, help="epochs between checkpoints, 0 for none")
+    parser.add_argument("--checkpoint-path", default="checkpoint.pt", help="where to keep the latest checkpoint")
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="a checkpoint to carry on training from")
+    parser.add_argument("--profile", action="store_true", help="time the phases of games and training")
+    parser.add_argument("--plot", action="store_true", help="plot the agent's history once training is done")
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    main()
+    main(**vars(parse_arguments()))
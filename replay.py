@@ -0,0 +1,201 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import catan
+
+
+class ReplayBuffer:
+    """
+    A store of self-play transitions kept in preallocated NumPy arrays rather than Python lists.
+
+    Each transition is a state vector, the action taken from it, the reward received and whether it was the last of its
+    player's moves in its game.
+    The arrays double in size as transitions come in. Once they would outgrow memory_limit they are moved into
+    memory-mapped .npy files, so the buffer can hold far more transitions than fit in RAM. When max_size is reached
+    the oldest transitions are overwritten.
+
+    Transitions can be sampled uniformly or in proportion to a priority, such as their last training loss.
+    """
+
+    def __init__(self, state_size=catan.STATE_SIZE, capacity=1 << 16, max_size=None, memory_limit=1 << 30,
+                 directory=None, seed=None):
+        """
+        Allocates an empty buffer.
+
+        :param state_size: The length of the state vectors.
+        :param capacity: The number of transitions to make room for up front.
+        :param max_size: The most transitions to keep, or None to keep them all.
+        :param memory_limit: The number of bytes the arrays may take up in RAM before they are memory-mapped.
+        :param directory: Where to put memory-mapped files, a new temporary directory by default.
+        :param seed: The seed for sampling.
+        """
+        self.state_size = state_size
+        self.max_size = max_size
+        self.memory_limit = memory_limit
+        self.directory = directory
+        self.temporary = directory is None
+        self.rng = np.random.default_rng(seed)
+        self.fields = {"states": (np.float32, (state_size,)), "actions": (np.int64, ()), "rewards": (np.float32, ()),
+                       "dones": (np.bool_, ()), "priorities": (np.float32, ())}
+        self.mapped = False
+        self.size = 0
+        self.next = 0  # where the next transition is written
+        self.capacity = 0
+        self.arrays = {}
+        self.grow(min(capacity, max_size or capacity))
+
+    def __len__(self):
+        return self.size
+
+    def nbytes(self, capacity):
+        """
+        :param capacity: A number of transitions.
+        :return: The number of bytes the arrays take up at that capacity.
+        """
+        return capacity * sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for dtype, shape in self.fields.values())
+
+    def grow(self, capacity):
+        """
+        Reallocates the arrays with room for more transitions, memory-mapping them once they pass memory_limit.
+
+        :param capacity: The number of transitions to make room for.
+        """
+        if not self.mapped and self.nbytes(capacity) > self.memory_limit:
+            self.mapped = True
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix="replay-")
+            os.makedirs(self.directory, exist_ok=True)
+        arrays = {}
+        for name, (dtype, shape) in self.fields.items():
+            if self.mapped:
+                # each generation gets its own file so the previous one can still be read while copying
+                path = os.path.join(self.directory, f"{name}-{capacity}.npy")
+                arrays[name] = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(capacity,) + shape)
+            else:
+                arrays[name] = np.zeros((capacity,) + shape, dtype=dtype)
+            if name in self.arrays:
+                arrays[name][:self.size] = self.arrays[name][:self.size]
+        self.release()
+        self.arrays = arrays
+        self.capacity = capacity
+        self.next = self.size  # the buffer only grows before it has wrapped, so the transitions are in order
+
+    def release(self):
+        """
+        Drops the current arrays, deleting their files if they were memory-mapped.
+        """
+        for array in self.arrays.values():
+            if isinstance(array, np.memmap):
+                array.flush()
+                os.remove(array.filename)
+        self.arrays = {}
+
+    def add_episode(self, states, actions, rewards, lengths=None):
+        """
+        Adds the transitions of one finished game.
+
+        :param states: The states the players decided from.
+        :param actions: The actions they took.
+        :param rewards: The rewards they received.
+        :param lengths: The number of transitions of each player, whose transitions follow one another, or None if
+            they are all one sequence. The last transition of each sequence is marked done.
+        """
+        n = len(states)
+        if self.size + n > self.capacity and (self.max_size is None or self.capacity < self.max_size):
+            capacity = max(2 * self.capacity, self.size + n)
+            self.grow(capacity if self.max_size is None else min(capacity, self.max_size))
+        indices = (self.next + np.arange(n)) % self.capacity
+        priority = self.arrays["priorities"][:self.size].max() if self.size else 1
+        self.arrays["states"][indices] = states
+        self.arrays["actions"][indices] = actions
+        self.arrays["rewards"][indices] = rewards
+        self.arrays["dones"][indices] = np.isin(np.arange(n), np.cumsum([n] if lengths is None else lengths) - 1)
+        self.arrays["priorities"][indices] = priority  # new transitions are sampled at least once
+        self.next = (self.next + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def add_trajectory(self, trajectory):
+        """
+        Adds the transitions of a game played by catan.simulate.
+
+        :param trajectory: The game's trajectory.
+        """
+        self.add_episode(trajectory.states, trajectory.actions, trajectory.rewards, trajectory.lengths)
+
+    def get(self, indices):
+        """
+        :param indices: The transitions to get.
+        :return: The states, actions and rewards of the transitions.
+        """
+        return self.arrays["states"][indices], self.arrays["actions"][indices], self.arrays["rewards"][indices]
+
+    def sample(self, batch_size):
+        """
+        Samples transitions uniformly.
+
+        :param batch_size: The number of transitions to sample.
+        :return: The states, actions and rewards of the transitions, and their indices.
+        """
+        indices = self.rng.integers(self.size, size=batch_size)
+        return *self.get(indices), indices
+
+    def sample_prioritized(self, batch_size, alpha=0.6, beta=0.4):
+        """
+        Samples transitions in proportion to their priorities.
+
+        :param batch_size: The number of transitions to sample.
+        :param alpha: How strongly the priorities skew sampling, 0 being uniform.
+        :param beta: How much of that skew the importance weights correct, 1 being all of it.
+        :return: The states, actions and rewards of the transitions, their indices and their importance weights.
+        """
+        probabilities = self.arrays["priorities"][:self.size].astype(np.float64) ** alpha
+        probabilities /= probabilities.sum()
+        indices = self.rng.choice(self.size, size=batch_size, p=probabilities)
+        weights = (self.size * probabilities[indices]) ** -beta
+        return *self.get(indices), indices, (weights / weights.max()).astype(np.float32)
+
+    def update_priorities(self, indices, priorities):
+        """
+        Sets the priorities of sampled transitions, usually to their latest loss.
+
+        :param indices: The transitions' indices.
+        :param priorities: Their new priorities.
+        """
+        self.arrays["priorities"][indices] = np.maximum(priorities, 1e-6)
+
+    def state_dict(self):
+        """
+        Gets what load_state_dict needs to carry on where the buffer is, without copying the transitions, which may
+        be more than fit in RAM. They are views of the buffer's arrays instead, so the buffer mustn't be added to until
+        they have been saved. Pickling them, as torch.save does, still reads each array into memory in turn.
+
+        :return: Views of the transitions held, and the position and sampling state.
+        """
+        return {"arrays": {name: array[:self.size] for name, array in self.arrays.items()},
+                "size": self.size, "next": self.next, "rng": self.rng.bit_generator.state}
+
+    def load_state_dict(self, state):
+        """
+        Replaces the buffer's contents with ones saved by state_dict.
+
+        :param state: What state_dict returned.
+        """
+        if state["size"] > self.capacity:
+            self.grow(state["size"])
+        for name, array in state["arrays"].items():
+            self.arrays[name][:state["size"]] = array
+        self.size = state["size"]
+        # until it has filled up to max_size and wrapped, a buffer carries on after its last transition
+        self.next = state["next"] % self.capacity if self.size == self.max_size else self.size
+        self.rng.bit_generator.state = state["rng"]
+
+    def close(self):
+        """
+        Frees the arrays and deletes any files the buffer made.
+        """
+        self.release()
+        if self.mapped and self.temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,254 @@
+import multiprocessing
+import queue
+
+import numpy as np
+import torch
+
+import catan
+from reinforcement import Network
+from runtime import Runtime
+
+
+class PolicyAgent:
+    """
+    Plays with a CPU copy of a network, for use inside rollout workers.
+    """
+
+    def __init__(self, network, fine_actions=False, policy=None):
+        """
+        Wraps a network that lives on the CPU.
+
+        :param network: The network to take actions from.
+        :param fine_actions: Whether the network picks among catan.ACTIONS from observations.
+        :param policy: The network as Runtime.prepare compiled it, to run instead of the network itself.
+        """
+        self.network = network
+        self.fine_actions = fine_actions
+        self.policy = policy
+
+    def get_action(self, state, mask=None):
+        """
+        Gets the action the agent should take given the current state.
+
+        :param state: The current state of the game.
+        :param mask: The legal actions, when using fine-grained actions.
+        :return: The action distribution the network gives for the state.
+        """
+        return self.get_actions(np.asarray(state)[None], None if mask is None else np.asarray(mask)[None])[0]
+
+    def get_actions(self, states, masks=None):
+        """
+        Gets the actions the agent should take in many games at once, with a single forward pass.
+
+        :param states: The current states of the games, one per row.
+        :param masks: The legal actions in each game, one per row, when using fine-grained actions.
+        :return: The action distributions the network gives for the states, one per row.
+        """
+        with torch.inference_mode():
+            if masks is not None:
+                masks = torch.from_numpy(np.asarray(masks, dtype=bool))
+            return (self.policy or self.network)(torch.from_numpy(np.asarray(states, dtype=np.float32)), masks).numpy()
+
+
+def worker(jobs, updates, results, input_size, output_size, runtime):
+    """
+    Plays games for a rollout pool until told to stop.
+
+    :param jobs: Where the pool hands out games as (seed, weights version) pairs, or None to stop.
+    :param updates: Where the pool sends this worker (version, state dict) weight updates.
+    :param results: Where finished games are sent back as (seed, weights version, trajectory) triples.
+    :param input_size: The network's input size.
+    :param output_size: The network's output size.
+    :param runtime: The runtime to play with, on the CPU.
+    """
+    runtime.configure()
+    network = Network(input_size, output_size).requires_grad_(False)
+    agent = PolicyAgent(network, output_size == catan.ACTIONS, runtime.prepare(network))
+    version = 0
+    while (job := jobs.get()) is not None:
+        seed, needed = job
+        state_dict = None
+        while version < needed or not updates.empty():  # catch up, then skip ahead to the newest weights sent
+            version, state_dict = updates.get()
+        if state_dict is not None:
+            network.load_state_dict(state_dict)
+        results.put((seed, version, catan.simulate(1, agent, seed)[0]))
+
+
+class RolloutPool:
+    """
+    A pool of worker processes that play self-play games with the learner's latest weights.
+
+    Each worker keeps its own CPU copy of the network. The learner pushes new weights with update_weights after each
+    training step, and every game handed out afterwards is played with them or newer ones. Finished games stream back
+    as soon as they end.
+
+    The pool can be run synchronously, with collect waiting for a set of games between training steps, or
+    asynchronously, with fill keeping the workers busy while the learner trains on whatever fresh returns.
+    """
+
+    def __init__(self, workers=None, seed=None, input_size=catan.STATE_SIZE, output_size=catan.INSTRUCTIONS,
+                 runtime=None):
+        """
+        Starts the worker processes.
+
+        :param workers: The number of worker processes, one per CPU by default.
+        :param seed: The seed of the first game played; later games count up from it.
+        :param input_size: The network's input size.
+        :param output_size: The network's output size.
+        :param runtime: How the workers run the network, on the CPU with one thread each by default, as the pool's
+            parallelism comes from its processes.
+        """
+        runtime = runtime or Runtime(threads=1)
+        context = multiprocessing.get_context("spawn")  # forking a process that has used torch is unsafe
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.updates = [context.Queue() for _ in range(workers or multiprocessing.cpu_count())]
+        self.processes = [context.Process(target=worker, args=(self.jobs, updates, self.results, input_size,
+                                                               output_size, runtime), daemon=True)
+                          for updates in self.updates]
+        for process in self.processes:
+            process.start()
+        self.seed = seed
+        self.version = 0
+        self.in_flight = 0  # games handed out whose results haven't been taken
+        self.outstanding = set()  # the seeds of those games
+        self.unplayed = []  # seeds to hand out before counting up, from a run being resumed
+        self.dropped = 0  # games fresh threw away for being played with weights that were too old
+
+    def update_weights(self, network):
+        """
+        Sends the learner's current weights to every worker.
+
+        :param network: The network whose weights the workers should play with.
+        """
+        self.version += 1
+        state_dict = {name: tensor.detach().cpu() for name, tensor in network.state_dict().items()}
+        for updates in self.updates:
+            updates.put((self.version, state_dict))
+
+    def submit(self, n_games):
+        """
+        Hands out games to the workers, to be played with the latest weights.
+
+        :param n_games: The number of games to play.
+        """
+        for _ in range(n_games):
+            if self.unplayed:
+                seed = self.unplayed.pop(0)
+            else:
+                seed = self.seed
+                if self.seed is not None:
+                    self.seed += 1
+            self.jobs.put((seed, self.version))
+            if seed is not None:
+                self.outstanding.add(seed)
+        self.in_flight += n_games
+
+    def result(self, block=True):
+        """
+        Takes one finished game.
+
+        :param block: Whether to wait for a game if none has finished.
+        :return: The version of the weights the game was played with and its trajectory, or None if none has finished
+            and block is False.
+        """
+        try:
+            seed, version, trajectory = self.results.get(block)
+        except queue.Empty:
+            return None
+        self.in_flight -= 1
+        self.outstanding.discard(seed)
+        return version, trajectory
+
+    def seeds(self):
+        """
+        :return: Where the pool is in its seeds, for restore_seeds: the next one to count up from and those of the
+            games handed out but not yet taken, which are lost if the pool is closed.
+        """
+        return {"next": self.seed, "outstanding": sorted(self.outstanding) + self.unplayed}
+
+    def restore_seeds(self, seeds):
+        """
+        Carries on with the seeds of a pool that was closed, playing the games it lost first, so that no seed is
+        played twice or skipped.
+
+        :param seeds: What the other pool's seeds returned.
+        """
+        self.seed = seeds["next"]
+        self.unplayed = list(seeds["outstanding"])
+
+    def fill(self, in_flight):
+        """
+        Hands out games until a number are being played or waiting to be taken, so the workers never run dry.
+
+        :param in_flight: The number of games to keep handed out.
+        """
+        self.submit(max(0, in_flight - self.in_flight))
+
+    def fresh(self, max_games, max_staleness=None):
+        """
+        Takes the games that have finished, waiting for one if none has. Games played with weights more than
+        max_staleness versions older than the latest are thrown away.
+
+        :param max_games: The most games to take.
+        :param max_staleness: How many versions behind the latest a game's weights may be, or None for any number.
+        :return: The trajectories of the games taken, at least one.
+        """
+        trajectories = []
+        while len(trajectories) < max_games:
+            result = self.result(block=not trajectories)
+            if result is None:
+                break
+            version, trajectory = result
+            if max_staleness is not None and self.version - version > max_staleness:
+                self.dropped += 1
+                self.submit(1)  # keep as many games going as before
+            else:
+                trajectories.append(trajectory)
+        return trajectories
+
+    def play(self, n_games):
+        """
+        Plays games across the workers, yielding each one as soon as it finishes.
+
+        :param n_games: The number of games to play.
+        :return: The trajectories of the games, in the order they finished.
+        """
+        self.submit(n_games)
+        for _ in range(n_games):
+            yield self.result()[1]
+
+    def collect(self, n_games):
+        """
+        Plays games across the workers and waits for all of them.
+
+        :param n_games: The number of games to play.
+        :return: The trajectories of the games.
+        """
+        return list(self.play(n_games))
+
+    def close(self):
+        """
+        Stops the worker processes, throwing away the games they haven't finished.
+        """
+        try:
+            while True:
+                self.jobs.get_nowait()
+        except queue.Empty:
+            pass
+        for _ in self.processes:
+            self.jobs.put(None)
+        for process in self.processes:
+            while process.is_alive():  # a worker can't exit until the results it sent have been read
+                try:
+                    self.results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
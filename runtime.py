@@ -0,0 +1,73 @@
+import torch
+
+
+COMPILERS = (None, "script", "compile")
+
+
+def default_device():
+    """
+    :return: The fastest device torch can use here: CUDA, then Apple's MPS, then the CPU.
+    """
+    if torch.cuda.is_available():
+        return "cuda"
+    return "mps" if torch.backends.mps.is_available() else "cpu"
+
+
+class Runtime:
+    """
+    How torch runs networks in one process: on which device, with how many threads, and whether compiled.
+
+    The learner and the rollout workers each have their own. Rollouts evaluate one small state at a time, which is
+    quickest on the CPU with few threads, so that many workers don't oversubscribe the cores between them, while the
+    learner trains on whole batches on whatever device suits it.
+
+    torch's thread counts belong to the process, so configure applies them to the process it's called in, once.
+    """
+
+    def __init__(self, device="cpu", threads=None, interop_threads=None, compiler=None):
+        """
+        :param device: The device networks run on.
+        :param threads: The number of threads each operation may use, or None to leave torch's default.
+        :param interop_threads: The number of threads independent operations may run on at once, or None to leave
+            torch's default.
+        :param compiler: How networks are compiled for inference: None to run them as they are, "script" for
+            TorchScript or "compile" for torch.compile.
+        """
+        if compiler not in COMPILERS:
+            raise ValueError(f"Unknown compiler {compiler!r}; expected one of {COMPILERS}.")
+        self.device = device
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.compiler = compiler
+
+    def configure(self):
+        """
+        Applies the thread counts to this process.
+        """
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        if self.interop_threads:
+            try:
+                torch.set_interop_threads(self.interop_threads)
+            except RuntimeError:  # it can only be set once, before any inter-op work
+                pass
+
+    def inference(self):
+        """
+        :return: A context manager to run networks in without tracking anything for autograd.
+        """
+        return torch.inference_mode()
+
+    def prepare(self, network):
+        """
+        Gets a network ready to take actions with.
+
+        :param network: A network on this runtime's device.
+        :return: The network run through the compiler. The result shares the network's parameters, so weights loaded
+            into the network carry over to it.
+        """
+        if self.compiler == "script":
+            return torch.jit.script(network)
+        if self.compiler == "compile":
+            return torch.compile(network)
+        return network